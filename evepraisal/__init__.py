@@ -25,8 +25,57 @@ app.config['VALID_SOLAR_SYSTEMS'] = {
     '30002053': 'Hek',
 }
 app.config['USER_AGENT'] = 'Evepraisal/1.0 +http://evepraisal.com/'
+app.config['EVE_CENTRAL_URL'] = 'http://api.eve-central.com/api/marketstat'
+app.config['EVE_MARKETDATA_URL'] = \
+    'http://api.eve-marketdata.com/api/item_prices2.json'
+# Idle keep-alive connections kept per upstream host
+app.config['HTTP_POOL_SIZE'] = 8
+# Cached prices are refreshed in the background once they're older than
+# PRICE_SOFT_TTL and are gone from the cache after PRICE_HARD_TTL (seconds)
+app.config['PRICE_SOFT_TTL'] = 60 * 60
+app.config['PRICE_HARD_TTL'] = 10 * 60 * 60
+app.config['PRICE_REFRESH_LOCK_TIMEOUT'] = 60
+# Background refreshes each worker process runs at the same time
+app.config['PRICE_REFRESH_THREADS'] = 4
+# Each worker keeps up to PRICE_L1_SIZE price entries per market in memory for
+# PRICE_L1_TTL seconds in front of memcached
+app.config['PRICE_L1_SIZE'] = 5000
+app.config['PRICE_L1_TTL'] = 60
+# How often (in seconds) each worker logs the hit ratios of its in-process
+# price caches
+app.config['PRICE_STATS_LOG_INTERVAL'] = 5 * 60
+# Upstream price API calls are made in parallel by a pool of this many threads
+app.config['PRICE_FETCH_WORKERS'] = 8
+# Timeout (in seconds) for a single upstream price API call
+app.config['PRICE_FETCH_TIMEOUT'] = 10
+# Time (in seconds) allowed for all upstream calls for one appraisal
+app.config['PRICE_FETCH_DEADLINE'] = 15
+# Time (in seconds) allowed for each upstream price API (see providers.py) by
+# name, instead of PRICE_FETCH_DEADLINE. e.g. {'eve-marketdata': 5}
+app.config['PRICE_PROVIDER_TIMEOUTS'] = {}
+# An upstream price API is skipped for PRICE_BREAKER_RESET seconds after
+# PRICE_BREAKER_FAILURES failed lookups in a row
+app.config['PRICE_BREAKER_FAILURES'] = 5
+app.config['PRICE_BREAKER_RESET'] = 60
+# Upstream price APIs (see estimate.PRICE_FETCHERS), in the order they're
+# tried. PriceProvider instances can be listed too.
+app.config['PRICE_PROVIDERS'] = ['eve-central', 'eve-marketdata']
+# Upstream price APIs are tried fastest first, going by their last
+# PRICE_STATS_WINDOW lookups that are less than PRICE_STATS_MAX_AGE seconds
+# old, once each of them has at least PRICE_STATS_MIN_SAMPLES of those
+app.config['PRICE_STATS_WINDOW'] = 100
+app.config['PRICE_STATS_MAX_AGE'] = 10 * 60
+app.config['PRICE_STATS_MIN_SAMPLES'] = 10
+# Providers without enough of those are probed (in the background, without
+# using the prices) at most once every PRICE_PROBE_INTERVAL seconds. Keep
+# PRICE_STATS_MIN_SAMPLES * PRICE_PROBE_INTERVAL under PRICE_STATS_MAX_AGE.
+app.config['PRICE_PROBE_INTERVAL'] = 30
 app.config['SQLALCHEMY_DATABASE_URI'] = ('sqlite:////%s/data/scans.db'
                                          % os.getcwd())
+# JSON columns (Parsed, Prices, BadLines) longer than this many characters are
+# stored zlib compressed. None stores everything as plain JSON.
+app.config['JSON_COMPRESS_THRESHOLD'] = 4096
+app.config['JSON_COMPRESS_LEVEL'] = 1
 app.config['CACHE_TYPE'] = 'memcached'
 app.config['CACHE_KEY_PREFIX'] = 'evepraisal'
 app.config['CACHE_MEMCACHED_SERVERS'] = ['127.0.0.1:11211']
@@ -34,6 +83,36 @@ app.config['CACHE_DEFAULT_TIMEOUT'] = 10 * 60
 app.config['TEMPLATE'] = 'sudorandom'
 app.config['SECRET_KEY'] = 'SET ME TO SOMETHING SECRET IN THE APP CONFIG!'
 app.config['USER_DEFAULT_OPTIONS'] = {'autosubmit': False, 'share': True}
+# Load the item type data when the app is imported instead of on the first
+# lookup. Useful for pre-fork servers (uWSGI without lazy-apps, gunicorn
+# --preload) so workers don't each load it.
+app.config['PRELOAD_TYPES'] = False
+# Number of type lookups (by name and by id) remembered by each worker
+app.config['TYPE_LOOKUP_CACHE_SIZE'] = 20000
+# Appraisals per page on /latest and /history
+app.config['LATEST_PAGE_SIZE'] = 200
+app.config['HISTORY_PAGE_SIZE'] = 100
+# Saved appraisals don't change, so their rendered pages (and item rows) are
+# cached for this long. Bump RESULT_CACHE_VERSION when the result templates
+# change so that cached pages aren't served anymore.
+app.config['RESULT_CACHE_TIMEOUT'] = 24 * 60 * 60
+app.config['RESULT_CACHE_VERSION'] = 3
+# Seconds an appraisal's comparison with other markets is cached
+app.config['COMPARE_CACHE_TIMEOUT'] = 5 * 60
+# A paste that was already appraised for the same market this many seconds
+# ago reuses that appraisal instead of being parsed and priced again (0 to
+# turn this off)
+app.config['DEDUP_WINDOW'] = 10 * 60
+# Queue pastes sent to /estimate for tools/appraisal_worker.py instead of
+# appraising them while the request waits
+app.config['ASYNC_APPRAISALS'] = False
+# Queued appraisals that couldn't be appraised are deleted by the workers
+# after this many seconds
+app.config['FAILED_JOB_RETENTION'] = 24 * 60 * 60
+# Most pastes /api/v1/estimate takes in one request
+app.config['API_MAX_PASTES'] = 100
+# /estimate/stream parses and prices pastes this many lines at a time
+app.config['STREAM_BATCH_LINES'] = 1000
 
 app.config.from_pyfile('../application.cfg', silent=True)
 
@@ -46,8 +125,11 @@ cache = Cache()
 cache.init_app(app)
 
 # Late import so modules can import their dependencies properly
-from . import models, views, routes, filters
+from . import models, views, routes, filters, parser, estimate
 
+if app.config['PRELOAD_TYPES']:
+    models.preload_types()
+    parser.get_name_trie()
 
 __all__ = ['models', 'views', 'routes', 'filters', 'app', 'db', 'cache']
 
@@ -83,3 +165,13 @@ def before_request():
 
     if 'options' not in session:
         session['options'] = app.config['USER_DEFAULT_OPTIONS']
+
+
+@app.after_request
+def after_request(response):
+    stats = getattr(g, 'price_cache_stats', None)
+    if stats:
+        app.logger.debug("Price cache: %(l1_hits)s in-process hits, "
+                         "%(hits)s hits, %(misses)s misses", stats)
+    estimate.log_cache_stats()
+    return response
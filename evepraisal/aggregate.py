@@ -0,0 +1,174 @@
+"""
+    Totals for appraisals. The items are first turned into columns
+    (quantities, volumes, sell and buy prices and the kind of result each
+    item came from) which are then summed in one pass, with NumPy when it's
+    installed and in plain Python otherwise.
+
+    Prices of types that are priced by their components (see
+    sum_components()) are worked out the same way.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TOTAL_KEYS = ('sell', 'buy', 'volume')
+
+
+def item_columns(items, kinds=None):
+    """ Returns a dict of equal length lists for the items that count towards
+        the totals: 'kind' (an index into 'kinds'), 'quantity', 'volume',
+        'sell' and 'buy'. Blueprint copies and items without a market are
+        left out, missing prices and volumes are 0. kinds, if given, has the
+        kind of every item in items. """
+    kind_index = {}
+    columns = {'kinds': [], 'kind': [], 'quantity': [], 'volume': [],
+               'sell': [], 'buy': []}
+    if kinds is None:
+        kinds = [None] * len(items)
+
+    for item, kind in zip(items, kinds):
+        # Don't factor blueprint copies into the total
+        if item.get('bpc'):
+            continue
+
+        if not item.get('market'):
+            continue
+
+        if kind not in kind_index:
+            kind_index[kind] = len(columns['kinds'])
+            columns['kinds'].append(kind)
+        columns['kind'].append(kind_index[kind])
+        columns['quantity'].append(item.get('quantity') or 1)
+        columns['volume'].append(item.get('volume') or 0)
+        prices = item['prices']
+        columns['sell'].append(prices['sell']['price'] if prices else 0)
+        columns['buy'].append(prices['buy']['price'] if prices else 0)
+    return columns
+
+
+def _numpy_totals(columns):
+    kind = numpy.array(columns['kind'], dtype=numpy.intp)
+    quantity = numpy.array(columns['quantity'], dtype=numpy.float64)
+    kind_count = len(columns['kinds'])
+    by_kind = {}
+    for key in TOTAL_KEYS:
+        values = numpy.array(columns[key], dtype=numpy.float64) * quantity
+        by_kind[key] = numpy.bincount(kind, weights=values,
+                                      minlength=kind_count)
+    totals = dict((key, float(by_kind[key].sum())) for key in TOTAL_KEYS)
+    totals['kinds'] = dict(
+        (kind_name, dict((key, float(by_kind[key][i])) for key in TOTAL_KEYS))
+        for i, kind_name in enumerate(columns['kinds']))
+    return totals
+
+
+def _python_totals(columns):
+    by_kind = [dict((key, 0.0) for key in TOTAL_KEYS)
+               for _ in columns['kinds']]
+    for i, quantity in enumerate(columns['quantity']):
+        subtotals = by_kind[columns['kind'][i]]
+        for key in TOTAL_KEYS:
+            subtotals[key] += columns[key][i] * quantity
+    totals = dict((key, sum(subtotals[key] for subtotals in by_kind))
+                  for key in TOTAL_KEYS)
+    totals['kinds'] = dict(zip(columns['kinds'], by_kind))
+    return totals
+
+
+def sum_totals(items, kinds=None, use_numpy=True):
+    """ Adds up the sell, buy and volume totals of items from iter_types().
+        When kinds is given the result also has the same totals for each
+        kind under 'kinds'. """
+    items = list(items)
+    columns = item_columns(items, kinds)
+    if numpy is not None and use_numpy:
+        totals = _numpy_totals(columns)
+    else:
+        totals = _python_totals(columns)
+    if kinds is None:
+        del totals['kinds']
+    return totals
+
+
+def api_totals(totals):
+    """ The sell, buy and volume totals, without the totals for each kind,
+        as the JSON API has always returned them """
+    return dict((key, totals[key]) for key in TOTAL_KEYS)
+
+
+def merge_totals(totals, more):
+    "Adds the totals in more to totals"
+    for key in TOTAL_KEYS:
+        totals[key] = totals.get(key, 0) + more[key]
+    for kind, subtotals in more.get('kinds', {}).items():
+        merge_totals(totals.setdefault('kinds', {}).setdefault(kind, {}),
+                     subtotals)
+    return totals
+
+
+#: The (market type, stat) pairs of pricing info that sum_components() adds
+PRICE_STATS = [(market_type, stat)
+               for market_type in ('buy', 'sell', 'all')
+               for stat in ('avg', 'min', 'max', 'price')]
+
+
+def _numpy_components(boms, price_map):
+    type_ids = list(boms)
+    component_ids = sorted(set(component_id for ids, _ in boms.values()
+                               for component_id in ids))
+    column = dict((component_id, i)
+                  for i, component_id in enumerate(component_ids))
+
+    rows, columns, quantities = [], [], []
+    for row, type_id in enumerate(type_ids):
+        ids, type_quantities = boms[type_id]
+        rows.extend([row] * len(ids))
+        columns.extend(column[component_id] for component_id in ids)
+        quantities.extend(type_quantities)
+    bom_matrix = numpy.zeros((len(type_ids), len(component_ids)))
+    numpy.add.at(bom_matrix, (rows, columns), quantities)
+
+    price_matrix = numpy.zeros((len(component_ids), len(PRICE_STATS)))
+    for i, component_id in enumerate(component_ids):
+        prices = price_map.get(component_id)
+        if prices:
+            price_matrix[i] = [prices[market_type][stat]
+                               for market_type, stat in PRICE_STATS]
+
+    sums = bom_matrix.dot(price_matrix).tolist()
+    return dict((type_id, sums[row]) for row, type_id in enumerate(type_ids))
+
+
+def _python_components(boms, price_map):
+    results = {}
+    for type_id, (ids, quantities) in boms.items():
+        sums = [0.0] * len(PRICE_STATS)
+        for component_id, quantity in zip(ids, quantities):
+            prices = price_map.get(component_id)
+            if not prices:
+                continue
+            for i, (market_type, stat) in enumerate(PRICE_STATS):
+                sums[i] += prices[market_type][stat] * quantity
+        results[type_id] = sums
+    return results
+
+
+def sum_components(boms, price_map, use_numpy=True):
+    """ Prices types by their bills of materials. boms is {typeId:
+        (component typeIds, quantities)} and price_map has the pricing
+        info of the components; components without a price count as 0.
+        Returns {typeId: pricing_info} with every stat in PRICE_STATS. """
+    if not boms:
+        return {}
+    if numpy is not None and use_numpy:
+        sums = _numpy_components(boms, price_map)
+    else:
+        sums = _python_components(boms, price_map)
+
+    results = {}
+    for type_id, values in sums.items():
+        prices = results[type_id] = {}
+        for (market_type, stat), value in zip(PRICE_STATS, values):
+            prices.setdefault(market_type, {})[stat] = value
+    return results
@@ -0,0 +1,32 @@
+"""Adds InputHash column to Appraisals table
+
+Revision ID: 1d7e4b8c9a3f
+Revises: 52d86f0c1e9b
+Create Date: 2026-10-18 15:12:37.480219
+
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__))))))
+
+# revision identifiers, used by Alembic.
+revision = '1d7e4b8c9a3f'
+down_revision = '52d86f0c1e9b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Existing rows are left without a hash. Only appraisals from the last
+# DEDUP_WINDOW seconds are ever reused, so there's no need to fill it in.
+def upgrade():
+    op.add_column('Appraisals',
+                  sa.Column('InputHash', sa.String(length=40), nullable=True))
+    op.create_index('ix_Appraisals_InputHash', 'Appraisals', ['InputHash'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Appraisals_InputHash', 'Appraisals')
+    op.drop_column('Appraisals', 'InputHash')
@@ -0,0 +1,145 @@
+"""Adds summary columns to Appraisals table and fills them in
+
+Revision ID: 3c1f9a2b7d4e
+Revises: 7affe38061d
+Create Date: 2026-10-18 11:02:45.318207
+
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__))))))
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a2b7d4e'
+down_revision = '7affe38061d'
+
+import base64
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+from evepraisal.helpers import iter_types
+from evepraisal.models import get_type_by_name
+
+SUMMARY_COLUMNS = [
+    ('SellTotal', sa.Float()),
+    ('BuyTotal', sa.Float()),
+    ('Volume', sa.Float()),
+    ('ItemCount', sa.Integer()),
+    ('RepresentativeTypeId', sa.Integer()),
+]
+BATCH_SIZE = 1000
+
+
+def decode_json(text, default=None):
+    """ Reads a JSON column as it's stored at this revision: plain JSON, or
+        '~1' followed by base64 encoded, zlib compressed JSON """
+    if text is None:
+        return default
+    if text.startswith('~1'):
+        text = zlib.decompress(base64.b64decode(text[2:]))
+    return json.loads(text)
+
+
+def summarize(kind, parsed, parsed_version, prices):
+    """ The summary column values for an appraisal, worked out the way
+        Appraisals.set_summary() did at this revision """
+    if parsed_version == 1:
+        results = parsed
+    else:
+        results = [[kind, parsed]]
+    price_map = dict(prices)
+
+    summary = {'SellTotal': 0, 'BuyTotal': 0, 'Volume': 0, 'ItemCount': 0,
+               'RepresentativeTypeId': None}
+    top_value = 0
+    for kind, result in results:
+        for item in iter_types(kind, result):
+            summary['ItemCount'] += 1
+            item = dict(item)
+            item_prices = None
+            details = get_type_by_name(item['name'])
+            if details:
+                item.update(details)
+                item_prices = price_map.get(item['typeID'])
+            if 'BLUEPRINT COPY' in item.get('details', ''):
+                continue
+            quantity = item.get('quantity', 1)
+
+            if item_prices:
+                value = item_prices['sell']['price'] * quantity
+                if (summary['RepresentativeTypeId'] is None or
+                        value > top_value):
+                    top_value = value
+                    summary['RepresentativeTypeId'] = item['typeID']
+
+            if not item.get('market'):
+                continue
+            quantity = quantity or 1
+            summary['Volume'] += (item.get('volume') or 0) * quantity
+            if item_prices:
+                summary['SellTotal'] += item_prices['sell']['price'] * quantity
+                summary['BuyTotal'] += item_prices['buy']['price'] * quantity
+    return summary
+
+
+def upgrade():
+    for name, column_type in SUMMARY_COLUMNS:
+        op.add_column('Appraisals',
+                      sa.Column(name, column_type, nullable=True))
+        op.create_index('ix_Appraisals_%s' % name, 'Appraisals', [name],
+                        unique=False)
+
+    appraisals = sa.sql.table(
+        'Appraisals',
+        sa.sql.column('Id', sa.Integer()),
+        sa.sql.column('Kind', sa.Text()),
+        sa.sql.column('Parsed', sa.Text()),
+        sa.sql.column('ParsedVersion', sa.Integer()),
+        sa.sql.column('Prices', sa.Text()),
+        *[sa.sql.column(name, column_type)
+          for name, column_type in SUMMARY_COLUMNS])
+
+    conn = op.get_bind()
+    count = 0
+    marker = 0
+    while True:
+        rows = conn.execute(
+            sa.select([appraisals.c.Id, appraisals.c.Kind,
+                       appraisals.c.Parsed, appraisals.c.ParsedVersion,
+                       appraisals.c.Prices])
+            .where(appraisals.c.Id > marker)
+            .order_by(appraisals.c.Id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+
+        print("Summarizing batch of %s. count=%s, marker=%s"
+              % (len(rows), count, marker))
+        for row in rows:
+            try:
+                summary = summarize(row.Kind,
+                                    decode_json(row.Parsed),
+                                    row.ParsedVersion,
+                                    decode_json(row.Prices, default=[]))
+            except Exception as e:
+                print('--[Unable to summarize %s: %s]---------' % (row.Id, e))
+                continue
+
+            conn.execute(
+                appraisals.update()
+                .where(appraisals.c.Id == row.Id)
+                .values(**summary))
+            count += 1
+        marker = rows[-1].Id
+
+    print("Total: %s" % count)
+
+
+def downgrade():
+    for name, _ in reversed(SUMMARY_COLUMNS):
+        op.drop_index('ix_Appraisals_%s' % name, 'Appraisals')
+        op.drop_column('Appraisals', name)
@@ -0,0 +1,31 @@
+"""Adds Status column to Appraisals table
+
+Revision ID: 4b6f2e9d1c08
+Revises: 1d7e4b8c9a3f
+Create Date: 2026-10-18 16:04:51.127833
+
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__))))))
+
+# revision identifiers, used by Alembic.
+revision = '4b6f2e9d1c08'
+down_revision = '1d7e4b8c9a3f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Existing rows are all done, which is a NULL Status
+def upgrade():
+    op.add_column('Appraisals',
+                  sa.Column('Status', sa.String(length=20), nullable=True))
+    op.create_index('ix_Appraisals_Status', 'Appraisals', ['Status'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Appraisals_Status', 'Appraisals')
+    op.drop_column('Appraisals', 'Status')
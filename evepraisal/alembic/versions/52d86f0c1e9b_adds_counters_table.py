@@ -0,0 +1,47 @@
+"""Adds Counters table and fills it in from the Appraisals table
+
+Revision ID: 52d86f0c1e9b
+Revises: 3c1f9a2b7d4e
+Create Date: 2026-10-18 14:21:09.604772
+
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__))))))
+
+# revision identifiers, used by Alembic.
+revision = '52d86f0c1e9b'
+down_revision = '3c1f9a2b7d4e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    counters = op.create_table(
+        'Counters',
+        sa.Column('Name', sa.String(length=100), nullable=False),
+        sa.Column('Value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('Name'))
+
+    appraisals = sa.sql.table('Appraisals',
+                              sa.sql.column('Id', sa.Integer()),
+                              sa.sql.column('Kind', sa.Text()),
+                              sa.sql.column('Market', sa.Integer()))
+    conn = op.get_bind()
+    count = sa.func.count(appraisals.c.Id)
+    rows = [{'Name': 'appraisals',
+             'Value': conn.execute(sa.select([count])).scalar()}]
+    for column, label in [(appraisals.c.Kind, 'kind'),
+                          (appraisals.c.Market, 'market')]:
+        q = sa.select([column, count]).group_by(column)
+        for value, value_count in conn.execute(q):
+            if value is not None:
+                rows.append({'Name': 'appraisals:%s:%s' % (label, value),
+                             'Value': value_count})
+    op.bulk_insert(counters, rows)
+
+
+def downgrade():
+    op.drop_table('Counters')
@@ -1,32 +1,188 @@
-from flask import jsonify
-from models import Appraisals
+import json
+
+from flask import g, jsonify, request, url_for, Response
+from sqlalchemy.orm import undefer_group
+from models import (Appraisals, latest_query, history_query, split_page,
+                    parse_cursor)
+from aggregate import api_totals, merge_totals
+from estimate import get_comparison
+from helpers import compared_markets
 from filters import get_market_name
-from . import cache
+from pagecache import (get_meta, set_meta, appraisal_meta, can_view,
+                       result_etag, is_not_modified, cached_response,
+                       get_page, set_page)
+import jobs
+from . import app
+
+
+def estimate_cost():
+    """ Appraises a batch of pastes, sent as JSON:
+        {"market": "30000142", "pastes": ["paste", ...]}. Nothing is saved.
+        Returns {"appraisals": [...], "totals": {...}} with the appraisals
+        in the same order as the pastes, or for format=ndjson (or an Accept
+        header asking for it) one line per paste and a last one with the
+        totals. """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('pastes'), list):
+        return "Expected a JSON object with a list of pastes", 400
+    pastes = data['pastes']
+    if not all(isinstance(paste, basestring) for paste in pastes):
+        return "Every paste has to be a string", 400
+    if len(pastes) > app.config['API_MAX_PASTES']:
+        return "Too many pastes, the limit is %s" % (
+            app.config['API_MAX_PASTES']), 413
+
+    market = str(data.get('market', '30000142'))
+    if market not in app.config['VALID_SOLAR_SYSTEMS']:
+        return "Invalid market", 400
+
+    results = [estimate_to_dict(appraisal)
+               for appraisal in jobs.appraise_batch(pastes, market)]
+    totals = {}
+    for result in results:
+        if 'totals' in result:
+            merge_totals(totals, result['totals'])
+
+    if (request.args.get('format') == 'ndjson' or
+            request.accept_mimetypes.best == 'application/x-ndjson'):
+        lines = [json.dumps({'appraisal': result}) for result in results]
+        lines.append(json.dumps({'totals': totals}))
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='application/x-ndjson')
+    return jsonify({'appraisals': results, 'totals': totals})
+
+
+def estimate_to_dict(appraisal):
+    "An appraisal from appraise_batch() (None if unparsable) as JSON"
+    if appraisal is None:
+        return {'error': jobs.ERRORS[jobs.UNPARSABLE]}
+    return {'kind': appraisal.Kind,
+            'market_id': int(appraisal.Market),
+            'market_name': get_market_name(appraisal.Market),
+            'items': list(appraisal.iter_types()),
+            'bad_lines': appraisal.BadLines,
+            'totals': api_totals(appraisal.totals())}
 
 
 def display_result(result_id):
-    result = cache.get('api:appraisal:%s' % result_id)
-    if result:
-        return result
+    meta = get_meta(result_id)
+    appraisal = None
+    if meta is None:
+        q = Appraisals.query.filter(Appraisals.Id == result_id)
+        appraisal = q.options(undefer_group('details')).first()
+        if appraisal:
+            meta = appraisal_meta(appraisal)
+            if appraisal.Status is None:
+                set_meta(meta)
+
+    if not meta or not meta['public']:
+        return "Not found", 404
+
+    if appraisal is not None and appraisal.Status is not None:
+        return jsonify(status_to_dict(appraisal)), 202
+
+    # Comparisons use the current prices, so they're only cached briefly
+    if request.args.get('compare'):
+        appraisal = appraisal or Appraisals.query.options(
+            undefer_group('details')).get(result_id)
+        result = result_to_dict(appraisal)
+        result['compare'] = []
+        for market in get_comparison(appraisal,
+                                     compared_markets(appraisal.Market)):
+            market['market_name'] = get_market_name(market['market_id'])
+            result['compare'].append(market)
+        return jsonify(result)
+
+    etag = result_etag(meta, 'json')
+    if is_not_modified(etag, meta['created']):
+        return cached_response('', etag, meta['created'],
+                               mimetype='application/json')
+
+    body = get_page(etag)
+    if body is None:
+        appraisal = appraisal or Appraisals.query.options(
+            undefer_group('details')).get(result_id)
+        body = jsonify(result_to_dict(appraisal)).get_data()
+        set_page(etag, body)
+    return cached_response(body, etag, meta['created'],
+                           mimetype='application/json')
 
-    q = Appraisals.query.filter(Appraisals.Id == result_id)
-    q = q.filter(Appraisals.Public == True)  # noqa
 
-    appraisal = q.first()
+def result_to_dict(appraisal):
+    return {'id': appraisal.Id,
+            'kind': appraisal.Kind,
+            'created': appraisal.Created,
+            'market_id': appraisal.Market,
+            'market_name': get_market_name(appraisal.Market),
+            'items': list(appraisal.iter_types()),
+            'totals': api_totals(appraisal.totals())}
 
-    if not appraisal:
+
+def status(result_id):
+    "Where a queued appraisal is at, for clients waiting on it"
+    appraisal = Appraisals.query.get(result_id)
+    if not appraisal or not can_view(appraisal_meta(appraisal)):
         return "Not found", 404
+    return jsonify(status_to_dict(appraisal))
 
-    result = jsonify({'id': appraisal.Id,
-                      'kind': appraisal.Kind,
-                      'created': appraisal.Created,
-                      'market_id': appraisal.Market,
-                      'market_name': get_market_name(appraisal.Market),
-                      'items': list(appraisal.iter_types()),
-                      'totals': appraisal.totals()})
 
-    try:
-        cache.set('api:appraisal:%s' % result_id, result, timeout=30)
-    except Exception:
-        pass
+def status_to_dict(appraisal):
+    result = {'id': appraisal.Id,
+              'status': jobs.status(appraisal),
+              'url': url_for('display_result', result_id=appraisal.Id,
+                             _external=True)}
+    if appraisal.Status in jobs.ERRORS:
+        result['error'] = jobs.ERRORS[appraisal.Status]
     return result
+
+
+def summary_to_dict(appraisal):
+    return {'id': appraisal.Id,
+            'kind': appraisal.Kind,
+            'created': appraisal.Created,
+            'market_id': appraisal.Market,
+            'market_name': get_market_name(appraisal.Market),
+            'public': appraisal.Public,
+            'item_count': appraisal.ItemCount,
+            'representative_type_id': appraisal.RepresentativeTypeId,
+            'totals': {'sell': appraisal.SellTotal,
+                       'buy': appraisal.BuyTotal,
+                       'volume': appraisal.Volume}}
+
+
+def appraisal_page(appraisals, next_cursor, endpoint, **args):
+    "JSON for a page of appraisals, with the URL of the next page"
+    next_url = None
+    if next_cursor:
+        next_url = url_for(endpoint, before=next_cursor, _external=True,
+                           **args)
+    return jsonify({'appraisals': [summary_to_dict(appraisal)
+                                   for appraisal in appraisals],
+                    'next': next_cursor,
+                    'next_url': next_url})
+
+
+def latest():
+    kind = request.args.get('kind')
+    try:
+        cursor = parse_cursor(request.args.get('before'))
+    except ValueError:
+        return "Invalid cursor", 400
+
+    appraisals, next_cursor = split_page(latest_query(kind, cursor).all(),
+                                         app.config['LATEST_PAGE_SIZE'])
+    return appraisal_page(appraisals, next_cursor, 'api_latest', kind=kind)
+
+
+def history():
+    if not g.user:
+        return "Login Required", 401
+    try:
+        cursor = parse_cursor(request.args.get('before'))
+    except ValueError:
+        return "Invalid cursor", 400
+
+    appraisals, next_cursor = split_page(
+        history_query(g.user.Id, cursor).all(),
+        app.config['HISTORY_PAGE_SIZE'])
+    return appraisal_page(appraisals, next_cursor, 'api_history')
@@ -1,9 +1,23 @@
-import urllib2
 import json
+import os
+import threading
+import time
 import xml.etree.ElementTree as ET
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from flask import g, has_app_context
 
 from . import app, cache
-from models import get_type_by_id
+from httpclient import HTTPClient, HTTPError
+from lru import LRUCache
+from providers import PriceProvider, ProviderRegistry
+from aggregate import sum_components
+from models import Appraisals, get_type_by_id, get_bill_of_materials
+
+http_client = HTTPClient(pool_size=app.config['HTTP_POOL_SIZE'],
+                         timeout=app.config['PRICE_FETCH_TIMEOUT'],
+                         user_agent=app.config['USER_AGENT'])
 
 
 def memcache_type_key(typeId, options=None):
@@ -13,17 +27,233 @@ def memcache_type_key(typeId, options=None):
 
 
 def get_cached_values(eve_types, options=None):
-    "Get Cached values given the eve_types"
+    """ Get Cached values given the eve_types. Prices that are past their
+        soft expiry are still returned but get refreshed in the background.
+    """
+    if len(eve_types) == 0:
+        return {}
+
+    l1 = get_l1_cache(options=options)
+    entries = l1.get_many(eve_types)
+    l1_hits = len(entries)
+
+    missing = [eve_type for eve_type in eve_types if eve_type not in entries]
+    if missing:
+        keys = [memcache_type_key(eve_type, options=options)
+                for eve_type in missing]
+        fetched = dict((eve_type, obj) for eve_type, obj
+                       in zip(missing, cache.get_many(*keys)) if obj)
+        l1.set_many(fetched)
+        entries.update(fetched)
+
     found = {}
-    for eve_type in eve_types:
-        key = memcache_type_key(eve_type, options=options)
-        obj = cache.get(key)
-        if obj:
-            found[eve_type] = obj
+    stale = []
+    now = time.time()
+    for eve_type, obj in entries.items():
+        # Entries cached before soft expiry was added are the bare prices
+        if 'refresh_at' in obj:
+            if obj['refresh_at'] < now:
+                stale.append(eve_type)
+            obj = obj['prices']
+        found[eve_type] = obj
+
+    record_cache_stats(l1_hits, len(found) - l1_hits,
+                       len(eve_types) - len(found))
+    if stale:
+        refresh_in_background(stale, options=options)
     return found
 
 
-def get_market_values(eve_types, options=None):
+def cache_prices(prices, options=None):
+    """ Caches a dict of {typeId: pricing_info} with a single call. Entries
+        are considered stale after PRICE_SOFT_TTL and are dropped after
+        PRICE_HARD_TTL. """
+    if not prices:
+        return
+    refresh_at = time.time() + app.config['PRICE_SOFT_TTL']
+    entries = dict((type_id, {'prices': v, 'refresh_at': refresh_at})
+                   for type_id, v in prices.items())
+    cache.set_many(dict((memcache_type_key(type_id, options=options), entry)
+                        for type_id, entry in entries.items()),
+                   timeout=app.config['PRICE_HARD_TTL'])
+    get_l1_cache(options=options).set_many(entries)
+
+
+_l1_caches = {}
+_l1_lock = threading.Lock()
+
+
+def get_l1_cache(options=None):
+    """ Returns the in-process cache of price entries (as stored in memcached)
+        for the market in options, keyed by typeId. """
+    if options is None:
+        options = {}
+    solarsystem_id = options.get('solarsystem_id', '-1')
+    with _l1_lock:
+        if solarsystem_id not in _l1_caches:
+            _l1_caches[solarsystem_id] = LRUCache(
+                maxsize=app.config['PRICE_L1_SIZE'],
+                ttl=app.config['PRICE_L1_TTL'])
+        return _l1_caches[solarsystem_id]
+
+
+def l1_cache_stats():
+    "Returns the size and hit ratio of the in-process cache for each market"
+    with _l1_lock:
+        caches = _l1_caches.items()
+    return dict((solarsystem_id, l1.stats()) for solarsystem_id, l1 in caches)
+
+
+_stats_logged_at = [time.time()]
+
+
+def log_cache_stats():
+    """ Logs l1_cache_stats() and the statistics of the upstream price
+        providers at most once every PRICE_STATS_LOG_INTERVAL seconds.
+        Called after each request. """
+    now = time.time()
+    with _l1_lock:
+        if now - _stats_logged_at[0] < app.config['PRICE_STATS_LOG_INTERVAL']:
+            return
+        _stats_logged_at[0] = now
+    for solarsystem_id, stats in sorted(l1_cache_stats().items()):
+        app.logger.info("In-process price cache for %s: %s/%s entries, "
+                        "%s hits, %s misses (%.1f%%)", solarsystem_id,
+                        stats['size'], stats['maxsize'], stats['hits'],
+                        stats['misses'], stats['hit_ratio'] * 100)
+    for name, stats in sorted(get_price_providers().stats().items()):
+        expected_cost = stats['expected_cost']
+        app.logger.info("Price provider %s: %s calls, %.1f%% errors, "
+                        "%.3fs average, expected cost %s%s", name,
+                        stats['calls'], stats['error_rate'] * 100,
+                        stats['avg_latency'],
+                        '%.3fs' % expected_cost
+                        if expected_cost is not None else 'unknown',
+                        ', circuit open' if stats['open'] else '')
+
+
+_refresh_slots = threading.BoundedSemaphore(
+    app.config['PRICE_REFRESH_THREADS'])
+
+
+def refresh_lock_key(eve_type, options=None):
+    "The cache key locking the refresh of a type in one market"
+    return 'lock:%s' % memcache_type_key(eve_type, options=options)
+
+
+def refresh_in_background(eve_types, options=None):
+    """ Re-prices stale types from a background thread, so the request
+        doesn't wait for it. Each worker runs at most PRICE_REFRESH_THREADS
+        refreshes at once; the stale prices are still served when a refresh
+        can't be started. """
+    if not _refresh_slots.acquire(False):
+        return
+    thread = threading.Thread(target=_refresh, args=(eve_types, options))
+    thread.daemon = True
+    thread.start()
+
+
+def _refresh(eve_types, options):
+    """ Takes a lock per type with cache.add() and re-prices the types it
+        got the lock for, so a type that's in many pastes is only refreshed
+        once at a time across all workers """
+    locked = []
+    with app.app_context():
+        try:
+            timeout = app.config['PRICE_REFRESH_LOCK_TIMEOUT']
+            for eve_type in eve_types:
+                # Flask-Cache's add() doesn't pass on whether the key was
+                # added
+                if cache.cache.add(refresh_lock_key(eve_type, options),
+                                   1, timeout=timeout):
+                    locked.append(eve_type)
+            if locked:
+                refresh_market_prices(locked, options=options)
+        except Exception as e:
+            app.logger.exception(e)
+        finally:
+            if locked:
+                cache.delete_many(*[refresh_lock_key(eve_type, options)
+                                    for eve_type in locked])
+            _refresh_slots.release()
+
+
+def record_cache_stats(l1_hits, hits, misses):
+    """ Adds to the price cache hit/miss counts for the current request.
+        These are logged once the request is done. """
+    if not has_app_context():
+        return
+    stats = getattr(g, 'price_cache_stats', None)
+    if stats is None:
+        stats = g.price_cache_stats = {'l1_hits': 0, 'hits': 0, 'misses': 0}
+    stats['l1_hits'] += l1_hits
+    stats['hits'] += hits
+    stats['misses'] += misses
+
+
+#: What an upstream call can fail with: connection errors and timeouts,
+#: and responses that can't be read
+FETCH_ERRORS = (HTTPError, ValueError, KeyError, ET.ParseError)
+
+_pool = None
+_pool_pid = None
+
+
+def get_fetch_pool():
+    "Returns the thread pool used for upstream calls, one per process"
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPool(app.config['PRICE_FETCH_WORKERS'])
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def call_timeout(timeout):
+    """ The timeout for a single upstream call when all of the calls for a
+        lookup have timeout seconds """
+    if timeout is None:
+        return None
+    return min(timeout, app.config['PRICE_FETCH_TIMEOUT'])
+
+
+def fetch_chunks(fetch, chunks, timeout=None, failures=None):
+    """ Calls fetch(chunk) for every chunk at the same time using the fetch
+        pool and merges the resulting dicts. Chunks that error out or don't
+        finish within timeout seconds (PRICE_FETCH_DEADLINE by default) are
+        left out of the result, and what went wrong is added to failures
+        when it's given. """
+    if failures is None:
+        failures = []
+    if timeout is None:
+        timeout = app.config['PRICE_FETCH_DEADLINE']
+
+    if len(chunks) == 1:
+        try:
+            return fetch(chunks[0])
+        except FETCH_ERRORS as e:
+            app.logger.warning("API Call failed: %s", e)
+            failures.append(e)
+            return {}
+
+    pool = get_fetch_pool()
+    deadline = time.time() + timeout
+    pending = [pool.apply_async(fetch, (chunk,)) for chunk in chunks]
+
+    results = {}
+    for result in pending:
+        try:
+            results.update(result.get(max(deadline - time.time(), 0)))
+        except TimeoutError as e:
+            app.logger.warning("API Call didn't finish before the deadline")
+            failures.append(e)
+        except FETCH_ERRORS as e:
+            app.logger.warning("API Call failed: %s", e)
+            failures.append(e)
+    return results
+
+
+def get_market_values(eve_types, options=None, timeout=None, failures=None,
+                      cache_results=True):
     """
         Takes list of typeIds. Returns dict of pricing details with typeId as
         the key. Calls out to the eve-central.
@@ -57,51 +287,77 @@ def get_market_values(eve_types, options=None):
     if options is None:
         options = {}
 
-    market_prices = {}
     solarsystem_id = options.get('solarsystem_id', -1)
-    for types in [eve_types[i:i + 100] for i in range(0, len(eve_types), 100)]:
-        query = []
-        query += ['typeid=%s' % str(type_id) for type_id in types]
-        all_price_metric = 'percentile'
-        if solarsystem_id == '-1':
-            buy_price_metric = 'percentile'
-            sell_price_metric = 'percentile'
-        else:
-            buy_price_metric = 'max'
-            sell_price_metric = 'min'
-            query += ['usesystem=%s' % solarsystem_id]
-        query_str = '&'.join(query)
-        url = "http://api.eve-central.com/api/marketstat?%s" % query_str
-        app.logger.debug("API Call: %s", url)
-        try:
-            request = urllib2.Request(url)
-            request.add_header('User-Agent', app.config['USER_AGENT'])
-            response = urllib2.build_opener().open(request).read()
-            stats = ET.fromstring(response).findall("./marketstat/type")
-
-            for marketstat in stats:
-                k = int(marketstat.attrib.get('id'))
-                v = {}
-                for stat_type in ['sell', 'buy', 'all']:
-                    props = {}
-                    for stat in marketstat.find(stat_type):
-                        if not stat.tag == "generated":
-                            props[stat.tag] = float(stat.text)
-                    v[stat_type] = props
-                v['all']['price'] = v['all'][all_price_metric]
-                v['buy']['price'] = v['buy'][buy_price_metric]
-                v['sell']['price'] = v['sell'][sell_price_metric]
-                market_prices[k] = v
-
-                # Cache for up to 10 hours
-                cache.set(memcache_type_key(k, options=options),
-                          v, timeout=10 * 60 * 60)
-        except urllib2.HTTPError:
-            pass
+    chunks = [eve_types[i:i + 100] for i in range(0, len(eve_types), 100)]
+    market_prices = fetch_chunks(
+        lambda types: _get_market_values_chunk(
+            types, solarsystem_id, timeout=call_timeout(timeout)),
+        chunks, timeout=timeout, failures=failures)
+
+    if cache_results:
+        cache_prices(market_prices, options=options)
     return market_prices
 
 
-def get_market_values_2(eve_types, options=None):
+def get_market_values_markets(eve_types_by_market, timeout=None,
+                              failures=None):
+    """ get_market_values() for several markets at once. Takes and returns
+        dicts keyed by solarsystem_id. eve-central only does one system per
+        call, but the calls for every market are made at the same time. """
+    chunks = [(solarsystem_id, eve_types[i:i + 100])
+              for solarsystem_id, eve_types in eve_types_by_market.items()
+              for i in range(0, len(eve_types), 100)]
+
+    def fetch(chunk):
+        solarsystem_id, types = chunk
+        return dict(((solarsystem_id, type_id), v) for type_id, v in
+                    _get_market_values_chunk(
+                        types, solarsystem_id,
+                        timeout=call_timeout(timeout)).items())
+
+    return cache_market_prices(
+        fetch_chunks(fetch, chunks, timeout=timeout, failures=failures),
+        eve_types_by_market)
+
+
+def _get_market_values_chunk(types, solarsystem_id, timeout=None):
+    "Prices up to 100 typeIds with a single eve-central call"
+    query = []
+    query += ['typeid=%s' % str(type_id) for type_id in types]
+    all_price_metric = 'percentile'
+    if solarsystem_id == '-1':
+        buy_price_metric = 'percentile'
+        sell_price_metric = 'percentile'
+    else:
+        buy_price_metric = 'max'
+        sell_price_metric = 'min'
+        query += ['usesystem=%s' % solarsystem_id]
+    query_str = '&'.join(query)
+    url = "%s?%s" % (app.config['EVE_CENTRAL_URL'], query_str)
+    app.logger.debug("API Call: %s", url)
+
+    market_prices = {}
+    response = http_client.get(url, timeout=timeout)
+    stats = ET.fromstring(response).findall("./marketstat/type")
+
+    for marketstat in stats:
+        k = int(marketstat.attrib.get('id'))
+        v = {}
+        for stat_type in ['sell', 'buy', 'all']:
+            props = {}
+            for stat in marketstat.find(stat_type):
+                if not stat.tag == "generated":
+                    props[stat.tag] = float(stat.text)
+            v[stat_type] = props
+        v['all']['price'] = v['all'][all_price_metric]
+        v['buy']['price'] = v['buy'][buy_price_metric]
+        v['sell']['price'] = v['sell'][sell_price_metric]
+        market_prices[k] = v
+    return market_prices
+
+
+def get_market_values_2(eve_types, options=None, timeout=None,
+                        failures=None, cache_results=True):
     """
         Takes list of typeIds. Returns dict of pricing details with typeId as
         the key. Calls out to the eve-marketdata.
@@ -134,62 +390,111 @@ def get_market_values_2(eve_types, options=None):
     if options is None:
         options = {}
 
-    market_prices = {}
     solarsystem_id = options.get('solarsystem_id', '-1')
-    for types in [eve_types[i:i + 200] for i in range(0, len(eve_types), 200)]:
-        typeIds_str = 'type_ids=%s' % ','.join(str(type_id)
-                                               for type_id in types)
-        query = [typeIds_str]
-
-        if solarsystem_id != '-1':
-            query += ['usesystem=%s' % solarsystem_id]
-
-            solarsystem_ids_str = ','.join(
-                [str(options.get('solarsystem_id', 30000142))])
-            query += ['solarsystem_ids=%s' % solarsystem_ids_str]
-        query_str = '&'.join(query)
-
-        url = "http://api.eve-marketdata.com/api/item_prices2.json?" \
-            "char_name=magerawr&buysell=a&%s" % (query_str)
-        app.logger.debug("API Call: %s", url)
-        try:
-            request = urllib2.Request(url)
-            request.add_header('User-Agent', app.config['USER_AGENT'])
-            response = json.loads(urllib2.build_opener().open(request).read())
-
-            for row in response['emd']['result']:
-                row = row['row']
-                k = int(row['typeID'])
-                if k not in market_prices:
-                    market_prices[k] = {}
-                if row['buysell'] == 's':
-                    price = float(row['price'])
-                    market_prices[k]['sell'] = {'avg': price,
-                                                'min': price,
-                                                'max': price}
-                elif row['buysell'] == 'b':
-                    price = float(row['price'])
-                    market_prices[k]['buy'] = {'avg': price,
-                                               'min': price,
-                                               'max': price}
-
-            for typeId, prices in market_prices.iteritems():
-                avg = (prices['sell']['avg'] + prices['buy']['avg']) / 2
-                market_prices[typeId]['all'] = {'avg': avg,
-                                                'min': avg,
-                                                'max': avg,
-                                                'price': avg}
-                market_prices[typeId]['buy']['price'] = \
-                    market_prices[typeId]['buy']['max']
-                market_prices[typeId]['sell']['price'] = \
-                    market_prices[typeId]['sell']['min']
-
-                # Cache for up to 10 hours
-                cache.set(
-                    memcache_type_key(typeId, options=options),
-                    prices, timeout=10 * 60 * 60)
-        except urllib2.HTTPError:
-            pass
+    chunks = [eve_types[i:i + 200] for i in range(0, len(eve_types), 200)]
+    market_prices = fetch_chunks(
+        lambda types: _get_market_values_2_chunk(
+            types, solarsystem_id, timeout=call_timeout(timeout)),
+        chunks, timeout=timeout, failures=failures)
+
+    if cache_results:
+        cache_prices(market_prices, options=options)
+    return market_prices
+
+
+def get_market_values_2_markets(eve_types_by_market, timeout=None,
+                                failures=None):
+    """ get_market_values_2() for several markets at once. Takes and returns
+        dicts keyed by solarsystem_id. eve-marketdata prices a chunk of
+        types in any number of solar systems with one call, so the types
+        asked for in any market are priced in all of them together. The
+        whole universe ('-1') can't be asked for like that and is priced
+        on its own. """
+    markets = dict(eve_types_by_market)
+    market_prices = {}
+    if '-1' in markets:
+        market_prices['-1'] = get_market_values_2(
+            markets.pop('-1'), timeout=timeout, failures=failures)
+    if not markets:
+        return market_prices
+
+    eve_types = sorted(set(eve_type for eve_types in markets.values()
+                           for eve_type in eve_types))
+    chunks = [eve_types[i:i + 200] for i in range(0, len(eve_types), 200)]
+    solarsystem_ids = sorted(markets)
+    found = fetch_chunks(
+        lambda types: _get_market_values_2_chunk(
+            types, solarsystem_ids, timeout=call_timeout(timeout)),
+        chunks, timeout=timeout, failures=failures)
+
+    market_prices.update(cache_market_prices(found, markets))
+    return market_prices
+
+
+def cache_market_prices(found, eve_types_by_market):
+    """ Splits {(solarsystem_id, typeId): pricing_info} up by market,
+        keeping only the types that were asked for, and caches them """
+    market_prices = {}
+    for solarsystem_id, eve_types in eve_types_by_market.items():
+        wanted = set(eve_types)
+        prices = dict((type_id, v) for (system, type_id), v in found.items()
+                      if system == solarsystem_id and type_id in wanted)
+        cache_prices(prices, options={'solarsystem_id': solarsystem_id})
+        market_prices[solarsystem_id] = prices
+    return market_prices
+
+
+def _get_market_values_2_chunk(types, solarsystem_id, timeout=None):
+    """ Prices up to 200 typeIds with a single eve-marketdata call. When
+        solarsystem_id is a list of them, the prices are for every one of
+        those systems and keyed by (solarsystem_id, typeId). """
+    typeIds_str = 'type_ids=%s' % ','.join(str(type_id)
+                                           for type_id in types)
+    query = [typeIds_str]
+
+    by_system = isinstance(solarsystem_id, list)
+    if by_system:
+        query += ['solarsystem_ids=%s' % ','.join(solarsystem_id)]
+    elif solarsystem_id != '-1':
+        query += ['usesystem=%s' % solarsystem_id]
+        query += ['solarsystem_ids=%s' % solarsystem_id]
+    query_str = '&'.join(query)
+
+    url = "%s?char_name=magerawr&buysell=a&%s" % (
+        app.config['EVE_MARKETDATA_URL'], query_str)
+    app.logger.debug("API Call: %s", url)
+
+    market_prices = {}
+    response = json.loads(http_client.get(url, timeout=timeout))
+
+    for row in response['emd']['result']:
+        row = row['row']
+        k = int(row['typeID'])
+        if by_system:
+            k = (str(row['solarsystemID']), k)
+        if k not in market_prices:
+            market_prices[k] = {}
+        if row['buysell'] == 's':
+            price = float(row['price'])
+            market_prices[k]['sell'] = {'avg': price,
+                                        'min': price,
+                                        'max': price}
+        elif row['buysell'] == 'b':
+            price = float(row['price'])
+            market_prices[k]['buy'] = {'avg': price,
+                                       'min': price,
+                                       'max': price}
+
+    for typeId, prices in market_prices.iteritems():
+        avg = (prices['sell']['avg'] + prices['buy']['avg']) / 2
+        market_prices[typeId]['all'] = {'avg': avg,
+                                        'min': avg,
+                                        'max': avg,
+                                        'price': avg}
+        market_prices[typeId]['buy']['price'] = \
+            market_prices[typeId]['buy']['max']
+        market_prices[typeId]['sell']['price'] = \
+            market_prices[typeId]['sell']['min']
     return market_prices
 
 
@@ -209,58 +514,223 @@ def get_invalid_values(eve_types, options=None):
 
 
 def get_componentized_values(eve_types, options=None):
-    componentized_items = {}
-    for eve_type in eve_types:
-        type_details = get_type_by_id(eve_type)
-        if type_details and 'components' in type_details:
-            component_types = dict((c['materialTypeID'], c['quantity'])
-                                   for c in type_details['components'])
+    """ Prices the types that are made of components (capital ships) as the
+        sum of their components """
+    if options is None:
+        options = {}
+    solarsystem_id = options.get('solarsystem_id', '-1')
+    return get_componentized_values_markets({solarsystem_id: eve_types})[
+        solarsystem_id]
 
-            component_prices = get_market_prices(component_types.keys(),
-                                                 options=options)
-            price_map = dict(component_prices)
-            zeroed_price = {'avg': 0, 'min': 0, 'max': 0, 'price': 0}
-            complete_price_data = {
-                'buy': zeroed_price.copy(),
-                'sell': zeroed_price.copy(),
-                'all': zeroed_price.copy(),
-            }
-            for component, quantity in component_types.items():
-                for market_type in ['buy', 'sell', 'all']:
-                    for stat in ['avg', 'min', 'max', 'price']:
-                        _price = price_map.get(component)
-                        if _price:
-                            complete_price_data[market_type][stat] += (
-                                _price[market_type][stat] * quantity)
-            componentized_items[eve_type] = complete_price_data
-            # Cache for up to 10 hours
-            cache.set(
-                memcache_type_key(eve_type, options=options),
-                complete_price_data,
-                timeout=10 * 60 * 60)
-
-    return componentized_items
-
-
-def get_market_prices(modules, options=None):
-    unpriced_modules = modules[:]
-    prices = {}
-    for pricing_method in [get_invalid_values,
+
+def get_componentized_values_markets(eve_types_by_market):
+    """ get_componentized_values() for several markets at once. Takes and
+        returns dicts keyed by solarsystem_id. The components of every type
+        are priced in every market together, with one pricing pass. """
+    boms = {}
+    for eve_types in eve_types_by_market.values():
+        for eve_type in eve_types:
+            bom = get_bill_of_materials(eve_type)
+            if bom:
+                boms[eve_type] = bom
+    if not boms:
+        return dict((market, {}) for market in eve_types_by_market)
+
+    component_types = set(component_type for component_types, _
+                          in boms.values()
+                          for component_type in component_types)
+    component_prices = get_prices_for_markets(list(component_types),
+                                              list(eve_types_by_market))
+
+    market_prices = {}
+    for solarsystem_id, eve_types in eve_types_by_market.items():
+        prices = sum_components(dict((eve_type, boms[eve_type])
+                                     for eve_type in eve_types
+                                     if eve_type in boms),
+                                component_prices[solarsystem_id])
+        cache_prices(prices, options={'solarsystem_id': solarsystem_id})
+        market_prices[solarsystem_id] = prices
+    return market_prices
+
+
+def get_market_prices(modules, options=None, pricing_methods=None,
+                      providers=None):
+    if options is None:
+        options = {}
+    solarsystem_id = options.get('solarsystem_id', '-1')
+    prices = get_prices_for_markets(modules, [solarsystem_id],
+                                    pricing_methods=pricing_methods,
+                                    providers=providers)
+    return prices[solarsystem_id].items()
+
+
+def get_prices_for_markets(modules, markets, pricing_methods=None,
+                           providers=None):
+    """ Prices modules in each of markets (solarsystem_ids) and returns
+        {solarsystem_id: {type_id: pricing_info}}. Each pricing method is
+        tried for every market before moving on to the next one, so methods
+        with a MARKET_BATCHED version (or price providers with a
+        fetch_markets) look up all of the markets together. The upstream
+        price providers (a ProviderRegistry, get_price_providers() by
+        default) come after pricing_methods, in the order they're
+        ordered() in.
+    """
+    if pricing_methods is None:
+        pricing_methods = [get_invalid_values,
                            get_cached_values,
-                           get_componentized_values,
-                           get_market_values,
-                           get_market_values_2]:
-        if len(modules) == len(prices):
+                           get_componentized_values]
+    upstream = ordered_providers(providers)
+    if modules:
+        probe_providers(upstream, modules,
+                        options={'solarsystem_id': markets[0]})
+    pricing_methods = pricing_methods + upstream
+    unpriced = dict((market, list(modules)) for market in markets)
+    prices = dict((market, {}) for market in markets)
+    for pricing_method in pricing_methods:
+        unpriced = dict((market, types) for market, types
+                        in unpriced.items() if types)
+        if not unpriced:
             break
-        # each pricing_method returns a dict with {type_id: pricing_info}
-        _prices = pricing_method(unpriced_modules, options=options)
-        # app.logger.debug("Found %s/%s items using method: %s",
-        #                  len(_prices), len(modules), pricing_method)
-        for type_id, pricing_info in _prices.items():
-            if type_id in unpriced_modules:
-                prices[type_id] = pricing_info
-                unpriced_modules.remove(type_id)
-            else:
-                app.logger.debug("[Method: %s] A price was returned which "
-                                 "wasn't asked for", pricing_method)
-    return prices.items()
+
+        batched = (MARKET_BATCHED.get(pricing_method) or
+                   getattr(pricing_method, 'for_markets', None))
+        if batched is not None and len(unpriced) > 1:
+            found = batched(unpriced)
+        else:
+            # each pricing_method returns a dict with {type_id: pricing_info}
+            found = dict((market, pricing_method(
+                types, options={'solarsystem_id': market}))
+                for market, types in unpriced.items())
+
+        for market, _prices in found.items():
+            unpriced_modules = unpriced[market]
+            for type_id, pricing_info in _prices.items():
+                if type_id in unpriced_modules:
+                    prices[market][type_id] = pricing_info
+                    unpriced_modules.remove(type_id)
+                else:
+                    app.logger.debug("[Method: %s] A price was returned "
+                                     "which wasn't asked for", pricing_method)
+    return prices
+
+
+#: Pricing methods that can price several markets with one lookup, see
+#: get_prices_for_markets()
+MARKET_BATCHED = {get_componentized_values: get_componentized_values_markets}
+
+
+def make_price_provider(name, fetch, fetch_markets=None):
+    "A PriceProvider set up from the app's config"
+    return PriceProvider(
+        name, fetch, fetch_markets,
+        timeout=app.config['PRICE_PROVIDER_TIMEOUTS'].get(
+            name, app.config['PRICE_FETCH_DEADLINE']),
+        failure_threshold=app.config['PRICE_BREAKER_FAILURES'],
+        reset_timeout=app.config['PRICE_BREAKER_RESET'],
+        window=app.config['PRICE_STATS_WINDOW'],
+        max_age=app.config['PRICE_STATS_MAX_AGE'],
+        min_samples=app.config['PRICE_STATS_MIN_SAMPLES'],
+        probe_interval=app.config['PRICE_PROBE_INTERVAL'])
+
+
+#: The built in upstream price APIs by name, for PRICE_PROVIDERS
+PRICE_FETCHERS = {
+    'eve-central': (get_market_values, get_market_values_markets),
+    'eve-marketdata': (get_market_values_2, get_market_values_2_markets),
+}
+
+_price_providers = None
+_price_providers_for = None
+
+
+def get_price_providers():
+    """ Returns the ProviderRegistry of the upstream price APIs in
+        PRICE_PROVIDERS, which is made again when that setting changes """
+    global _price_providers, _price_providers_for
+    entries = tuple(app.config['PRICE_PROVIDERS'])
+    if _price_providers is None or _price_providers_for != entries:
+        registry = ProviderRegistry()
+        for entry in entries:
+            if not isinstance(entry, PriceProvider):
+                entry = make_price_provider(entry, *PRICE_FETCHERS[entry])
+            registry.register(entry)
+        _price_providers, _price_providers_for = registry, entries
+    return _price_providers
+
+
+def probe_providers(providers, eve_types, options=None):
+    """ Starts a background call pricing eve_types with each of providers
+        (from ordered_providers()) after the first that's due a probe, so
+        the ones that are only asked for leftovers get statistics too """
+    now = time.time()
+    for provider in providers[1:]:
+        if provider.needs_probe(now) and provider.start_probe():
+            thread = threading.Thread(target=_probe,
+                                      args=(provider, eve_types, options))
+            thread.daemon = True
+            thread.start()
+
+
+def _probe(provider, eve_types, options):
+    with app.app_context():
+        try:
+            provider.probe(eve_types, options=options)
+        except Exception as e:
+            app.logger.exception(e)
+
+
+def ordered_providers(registry=None):
+    """ registry.ordered() (get_price_providers() by default), logging when
+        the order changes since that changes where prices come from """
+    if registry is None:
+        registry = get_price_providers()
+    providers = registry.ordered()
+    order = [provider.name for provider in providers]
+    if order != registry.last_order:
+        if registry.last_order is not None:
+            app.logger.info("Price providers are now tried in this order: "
+                            "%s", ', '.join(order) or 'none available')
+        registry.last_order = order
+    return providers
+
+
+def compare_markets(appraisal, markets):
+    """ Prices the items of appraisal in each of markets, all in one pass,
+        without parsing the paste again. Returns a list with the market_id,
+        totals and {typeID: prices} of each market. """
+    items = list(appraisal.iter_types())
+    type_ids = list(set(item['typeID'] for item in items if 'typeID' in item))
+    by_market = get_prices_for_markets(type_ids, markets)
+
+    comparison = []
+    for market in markets:
+        repriced = Appraisals(Kind=appraisal.Kind,
+                              Parsed=appraisal.Parsed,
+                              ParsedVersion=appraisal.ParsedVersion,
+                              Prices=by_market[market].items())
+        totals = repriced.totals()
+        comparison.append({'market_id': int(market),
+                           'totals': {'sell': totals['sell'],
+                                      'buy': totals['buy']},
+                           'prices': by_market[market]})
+    return comparison
+
+
+def get_comparison(appraisal, markets):
+    """ compare_markets(), cached for COMPARE_CACHE_TIMEOUT seconds for each
+        appraisal and list of markets """
+    key = 'compare:%s:%s' % (appraisal.Id, ','.join(markets))
+    comparison = cache.get(key)
+    if comparison is None:
+        comparison = compare_markets(appraisal, markets)
+        cache.set(key, comparison,
+                  timeout=app.config['COMPARE_CACHE_TIMEOUT'])
+    return comparison
+
+
+def refresh_market_prices(modules, options=None):
+    """ Prices modules skipping the cache lookup, so every price comes from
+        upstream and gets re-cached. """
+    return get_market_prices(modules, options=options,
+                             pricing_methods=[get_invalid_values,
+                                              get_componentized_values])
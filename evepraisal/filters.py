@@ -8,10 +8,13 @@ from . import app
 from models import get_type_by_name
 
 
+def is_from_igb():
+    "True for requests from the in-game browser"
+    return 'EVE-IGB' in request.headers.get('User-Agent', '')
+
+
 @app.context_processor
 def utility_processor():
-    def is_from_igb():
-        return 'EVE-IGB' in request.headers.get('User-Agent', '')
     return dict(is_from_igb=is_from_igb)
 
 
@@ -1,6 +1,6 @@
 from functools import wraps
 
-from flask import g, redirect, url_for, request, flash
+from flask import g, redirect, url_for, request, flash, current_app
 
 
 def login_required(func):
@@ -13,6 +13,36 @@ def login_required(func):
     return decorated_function
 
 
+def stream_template(template_name, **context):
+    """ Like render_template(), but returns a generator that yields the page
+        a piece at a time. Wrap it in stream_with_context() if the template
+        needs the request. """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(20)
+    return stream
+
+
+def compared_markets(market):
+    """ The markets to compare an appraisal for market with, from the
+        compare argument: a comma separated list of solarsystem_ids, or
+        'all' for every valid market """
+    value = request.args.get('compare', '')
+    valid_markets = current_app.config['VALID_SOLAR_SYSTEMS']
+    if value == 'all':
+        markets = sorted(valid_markets)
+    else:
+        markets = value.split(',')
+    compared = []
+    for solarsystem_id in markets:
+        if (solarsystem_id in valid_markets and
+                solarsystem_id != str(market) and
+                solarsystem_id not in compared):
+            compared.append(solarsystem_id)
+    return compared
+
+
 def iter_types(kind, result):
     if kind == 'bill_of_materials':
         for item in result:
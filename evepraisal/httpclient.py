@@ -0,0 +1,168 @@
+"""
+    A small keep-alive HTTP client shared by all of the upstream price
+    sources. Connections are pooled per host so consecutive API calls don't
+    pay for a new TCP connection and DNS lookup each time.
+"""
+import errno
+import httplib
+import os
+import socket
+import threading
+import zlib
+from Queue import LifoQueue, Empty, Full
+from urlparse import urlsplit
+
+
+#: socket errors meaning the server closed a kept-alive connection
+STALE_CONNECTION_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def is_stale_connection(error):
+    """ Whether error is what using a connection the server already closed
+        fails with. Timeouts aren't, the server may just be slow. """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, (httplib.BadStatusLine, httplib.CannotSendRequest)):
+        return True
+    return (isinstance(error, socket.error) and
+            error.errno in STALE_CONNECTION_ERRNOS)
+
+
+class HTTPError(IOError):
+    """ Raised for any failed request. status is None when the request never
+        got a response (connection refused, timeouts, etc). """
+    def __init__(self, url, status=None, reason=''):
+        IOError.__init__(self, "%s: %s %s" % (url, status, reason))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class HTTPClient(object):
+    """ Issues GET requests over pooled keep-alive connections.
+
+        pool_size is the number of idle connections kept per host. Requests
+        never block waiting for a connection; when the pool is empty a new
+        connection is made and only pool_size of them are kept afterwards.
+    """
+    def __init__(self, pool_size=8, timeout=10, user_agent=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.stats = {'requests': 0, 'new': 0, 'reused': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._pid = os.getpid()
+
+    def _pool(self, scheme, netloc):
+        with self._lock:
+            # Sockets can't be shared with forked workers
+            if self._pid != os.getpid():
+                self._pools = {}
+                self._pid = os.getpid()
+            key = (scheme, netloc)
+            if key not in self._pools:
+                self._pools[key] = LifoQueue(self.pool_size)
+            return self._pools[key]
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _get_connection(self, pool, scheme, netloc, timeout):
+        "An idle connection from pool, or a new one, and whether it's reused"
+        try:
+            conn = pool.get_nowait()
+        except Empty:
+            return self._new_connection(scheme, netloc, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _new_connection(self, scheme, netloc, timeout):
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=timeout)
+        try:
+            conn.connect()
+            # Small requests on a kept-alive connection would otherwise
+            # wait on Nagle's algorithm
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error:
+            # Leave it to conn.request() to report the failure
+            conn.close()
+        return conn
+
+    def _release(self, pool, conn):
+        try:
+            pool.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def get(self, url, timeout=None, headers=None):
+        """ Returns the (decompressed) body of the response for url. Raises
+            HTTPError on connection problems or when the status isn't 2XX. """
+        if timeout is None:
+            timeout = self.timeout
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+
+        request_headers = {'Accept-Encoding': 'gzip',
+                           'Connection': 'keep-alive'}
+        if self.user_agent:
+            request_headers['User-Agent'] = self.user_agent
+        request_headers.update(headers or {})
+
+        pool = self._pool(scheme, netloc)
+        self._count('requests')
+        conn, reused = self._get_connection(pool, scheme, netloc, timeout)
+        while True:
+            try:
+                conn.request('GET', path or '/', headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                # A reused connection may have been closed by the server
+                # while it sat in the pool. In that case retry once on a
+                # brand new connection. Anything else, timeouts included,
+                # isn't retried.
+                if reused and is_stale_connection(e):
+                    conn = self._new_connection(scheme, netloc, timeout)
+                    reused = False
+                    continue
+                self._count('errors')
+                raise HTTPError(url, reason=str(e))
+            self._count('reused' if reused else 'new')
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(pool, conn)
+
+        if response.getheader('Content-Encoding') == 'gzip':
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error as e:
+                self._count('errors')
+                raise HTTPError(url, response.status, str(e))
+
+        if not 200 <= response.status < 300:
+            self._count('errors')
+            raise HTTPError(url, response.status, response.reason)
+        return body
+
+    def close(self):
+        "Closes all idle connections"
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
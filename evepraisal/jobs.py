@@ -0,0 +1,156 @@
+"""
+    Appraising pastes, either right away (see appraise()) or later, by a
+    worker (tools/appraisal_worker.py) when ASYNC_APPRAISALS is on.
+
+    The queue is the Appraisals table itself. A queued appraisal only has
+    its RawInput, Market and owner filled in and its Status set to QUEUED.
+    Workers claim the oldest one by moving it to WORKING, fill in the rest
+    and clear Status, which is None for every finished appraisal. Ones that
+    end up UNPARSABLE or FAILED are deleted by prune_jobs() after a while.
+"""
+import time
+
+import evepaste
+from sqlalchemy.orm import undefer_group
+
+from . import app, db
+from estimate import get_market_prices
+from models import Appraisals, count_appraisal
+from parser import parse
+
+QUEUED = 'queued'
+WORKING = 'working'
+#: Finished, but nothing in the paste could be parsed
+UNPARSABLE = 'unparsable'
+#: Finished with an unexpected error (logged by the worker)
+FAILED = 'failed'
+
+ERRORS = {
+    UNPARSABLE: ('Error when parsing input: '
+                 'No valid parser found for the given text.'),
+    FAILED: 'Unable to appraise the given text, please try again later.',
+}
+
+
+def appraise(appraisal):
+    """ Parses and prices appraisal.RawInput for appraisal.Market and fills
+        in the rest of the appraisal. Raises evepaste.Unparsable. """
+    parse_results = parse(appraisal.RawInput)
+
+    # Populate types with pricing data
+    prices = get_market_prices(list(parse_results['unique_items']),
+                               options={'solarsystem_id':
+                                        str(appraisal.Market)})
+
+    appraisal.Kind = parse_results['representative_kind']
+    appraisal.Prices = prices
+    appraisal.Parsed = parse_results['results']
+    appraisal.ParsedVersion = 1
+    appraisal.BadLines = parse_results['bad_lines']
+    appraisal.set_summary()
+
+
+def appraise_batch(pastes, market):
+    """ Appraises several pastes for market, pricing every type in any of
+        them with one get_market_prices() call. Returns an unsaved
+        appraisal for each paste, or None for those that can't be parsed. """
+    results = []
+    type_ids = set()
+    for paste in pastes:
+        try:
+            parse_results = parse(paste)
+        except evepaste.Unparsable:
+            parse_results = None
+        else:
+            type_ids.update(parse_results['unique_items'])
+        results.append(parse_results)
+
+    prices = dict(get_market_prices(list(type_ids),
+                                    options={'solarsystem_id': str(market)}))
+
+    appraisals = []
+    for paste, parse_results in zip(pastes, results):
+        if parse_results is None:
+            appraisals.append(None)
+            continue
+        appraisal = Appraisals(
+            RawInput=paste,
+            Market=market,
+            Kind=parse_results['representative_kind'],
+            Prices=[(type_id, prices[type_id])
+                    for type_id in parse_results['unique_items']
+                    if type_id in prices],
+            Parsed=parse_results['results'],
+            ParsedVersion=1,
+            BadLines=parse_results['bad_lines'])
+        appraisal.set_summary()
+        appraisals.append(appraisal)
+    return appraisals
+
+
+def status(appraisal):
+    "One of the statuses above, or 'done'"
+    return appraisal.Status or 'done'
+
+
+def claim_job():
+    """ Moves the oldest queued appraisal to WORKING and returns it, or None
+        when the queue is empty. Any number of workers can call this at the
+        same time; each appraisal is only ever claimed by one of them. """
+    while True:
+        job_id = db.session.query(Appraisals.Id).filter(
+            Appraisals.Status == QUEUED).order_by(Appraisals.Id).limit(1)
+        job_id = job_id.scalar()
+        if job_id is None:
+            return None
+
+        claimed = Appraisals.query.filter(
+            Appraisals.Id == job_id,
+            Appraisals.Status == QUEUED).update({'Status': WORKING},
+                                                synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            q = Appraisals.query.options(undefer_group('details'))
+            return q.get(job_id)
+
+
+def run_job(appraisal):
+    "Appraises a claimed appraisal and saves it. Returns its new status."
+    try:
+        appraise(appraisal)
+    except evepaste.Unparsable:
+        db.session.rollback()
+        appraisal.Status = UNPARSABLE
+    except Exception as e:
+        app.logger.exception(e)
+        db.session.rollback()
+        appraisal.Status = FAILED
+    else:
+        appraisal.Status = None
+        count_appraisal(appraisal)
+    db.session.commit()
+    return status(appraisal)
+
+
+def requeue_jobs(failed=False):
+    """ Puts the appraisals left WORKING by workers that didn't finish back
+        in the queue, and the FAILED ones too if failed is set (UNPARSABLE
+        ones would fail the same way again). Only safe when no workers are
+        running. """
+    statuses = [WORKING, FAILED] if failed else [WORKING]
+    requeued = Appraisals.query.filter(Appraisals.Status.in_(statuses)).update(
+        {'Status': QUEUED}, synchronize_session=False)
+    db.session.commit()
+    return requeued
+
+
+def prune_jobs():
+    """ Deletes the UNPARSABLE and FAILED appraisals older than
+        FAILED_JOB_RETENTION seconds, which nothing else removes. Returns how
+        many were deleted. """
+    cutoff = time.time() - app.config['FAILED_JOB_RETENTION']
+    pruned = Appraisals.query.filter(
+        Appraisals.Status.in_([UNPARSABLE, FAILED]),
+        Appraisals.Created < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return pruned
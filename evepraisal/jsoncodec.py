@@ -0,0 +1,74 @@
+"""
+    Encoding for the JSON columns (see models.JsonType).
+
+    Values are stored as plain JSON text, like they always have been, unless
+    the JSON is longer than compress_threshold. Those are zlib compressed
+    and base64 encoded behind a two character header: MARKER and a version.
+    JSON text never starts with MARKER, so old rows can still be read.
+
+    ujson is used when it's installed and the stdlib json module otherwise.
+"""
+import base64
+import json
+import zlib
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+else:
+    # Versions before 2.0 round floats to 9 significant digits
+    if ujson.loads(ujson.dumps(0.1 + 0.2)) != 0.1 + 0.2:
+        ujson = None
+
+#: Starts every value that isn't plain JSON
+MARKER = '~'
+#: base64 encoded, zlib compressed JSON
+ZLIB_VERSION = '1'
+
+
+class JsonCodec(object):
+    """ Converts values to and from the text stored in a JsonType column.
+        compress_threshold=None turns compression off. fast=False always
+        uses the stdlib json module. """
+    def __init__(self, compress_threshold=4096, compress_level=1, fast=True):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.fast = fast and ujson is not None
+
+    # ujson can't handle integers that don't fit in 64 bits, which can come
+    # from pasted quantities. The stdlib json module is used for those.
+    def _dumps(self, value):
+        if self.fast:
+            try:
+                return ujson.dumps(value, escape_forward_slashes=False)
+            except OverflowError:
+                pass
+        return json.dumps(value)
+
+    def _loads(self, text):
+        if self.fast:
+            try:
+                return ujson.loads(text)
+            except ValueError:
+                pass
+        return json.loads(text)
+
+    def dumps(self, value):
+        text = self._dumps(value)
+        if (self.compress_threshold is not None and
+                len(text) > self.compress_threshold):
+            return (MARKER + ZLIB_VERSION +
+                    base64.b64encode(zlib.compress(text,
+                                                   self.compress_level)))
+        return text
+
+    def loads(self, text):
+        if text is None:
+            return None
+        if text.startswith(MARKER):
+            version = text[1:2]
+            if version != ZLIB_VERSION:
+                raise ValueError("Unknown JSON column encoding: %r" % version)
+            text = zlib.decompress(base64.b64decode(text[2:]))
+        return self._loads(text)
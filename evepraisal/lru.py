@@ -0,0 +1,90 @@
+"""
+    A small in-process LRU cache with optional expiry, used in front of
+    memcached for data that is read on almost every request.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache(object):
+    """ Keeps up to maxsize entries, dropping the least recently used one
+        when full. Entries older than ttl seconds are treated as missing
+        (ttl=None keeps them until they're pushed out). Safe to share
+        between threads. """
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get(self, key, now):
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return _missing
+        if expires is not None and expires < now:
+            self.misses += 1
+            return _missing
+        # Re-insert to mark as the most recently used
+        self._data[key] = (expires, value)
+        self.hits += 1
+        return value
+
+    def _set(self, key, value, now):
+        self._data.pop(key, None)
+        expires = now + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get(key, time.time())
+        return default if value is _missing else value
+
+    def get_many(self, keys):
+        "Returns a dict with the keys that were found"
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._get(key, now)
+                if value is not _missing:
+                    found[key] = value
+        return found
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value, time.time())
+
+    def set_many(self, mapping):
+        now = time.time()
+        with self._lock:
+            for key, value in mapping.items():
+                self._set(key, value, now)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0}
@@ -1,20 +1,38 @@
-import json
+import hashlib
+import threading
+import time
 
-from . import db
+from . import app, db
+from aggregate import sum_totals
 from helpers import iter_types
+from jsoncodec import JsonCodec
+from lru import LRUCache
+from typedb import open_type_database, normalize_type_name
 
-from sqlalchemy import types
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import types, desc, func, or_, and_, select, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred, undefer_group
+
+
+json_codec = JsonCodec(
+    compress_threshold=app.config['JSON_COMPRESS_THRESHOLD'],
+    compress_level=app.config['JSON_COMPRESS_LEVEL'])
 
 
 class JsonType(types.TypeDecorator):
+    """ Stores values as JSON text, encoded by codec (a JsonCodec, json_codec
+        by default) """
     impl = types.VARCHAR
 
+    def __init__(self, *args, **kwargs):
+        self.codec = kwargs.pop('codec', None) or json_codec
+        types.TypeDecorator.__init__(self, *args, **kwargs)
+
     def process_bind_param(self, value, engine):
-        return json.dumps(value)
+        return self.codec.dumps(value)
 
     def process_result_value(self, value, engine):
-        return json.loads(value)
+        return self.codec.loads(value)
 
 
 class Appraisals(db.Model):
@@ -23,40 +41,75 @@ class Appraisals(db.Model):
     Id = db.Column(db.Integer(), primary_key=True)
     #: Bad Lines
     Kind = db.Column(db.Text(), index=True)
+    # The large columns are only loaded when one of them is first used.
+    # Queries for a single appraisal should add
+    # .options(undefer_group('details')) to get them straight away.
     #: Raw Input taken from the user
-    RawInput = db.Column(db.Text())
+    RawInput = deferred(db.Column(db.Text()), group='details')
     #: JSON as a result of the parser (evepaste)
-    Parsed = db.Column(JsonType())
+    Parsed = deferred(db.Column(JsonType()), group='details')
     #: Parsed result Version
     ParsedVersion = db.Column(db.Integer())
     #: Prices
-    Prices = db.Column(JsonType())
+    Prices = deferred(db.Column(JsonType()), group='details')
     #: Bad Lines
-    BadLines = db.Column(JsonType())
+    BadLines = deferred(db.Column(JsonType()), group='details')
     Market = db.Column(db.Integer())
     Created = db.Column(db.Integer(), index=True)
     Public = db.Column(db.Boolean(), index=True, default=True)
     UserId = db.Column(db.Integer(), db.ForeignKey('Users.Id'), index=True)
-
-    def totals(self):
-        total_sell = total_buy = total_volume = 0
-
+    #: Summary of the parsed items, so listing appraisals doesn't have to
+    #: decode Parsed and Prices. Filled in by set_summary().
+    SellTotal = db.Column(db.Float(), index=True)
+    BuyTotal = db.Column(db.Float(), index=True)
+    Volume = db.Column(db.Float(), index=True)
+    #: Number of line items
+    ItemCount = db.Column(db.Integer(), index=True)
+    #: The type with the highest total sell value
+    RepresentativeTypeId = db.Column(db.Integer(), index=True)
+    #: input_hash() of RawInput, to find repeats of the same paste
+    InputHash = db.Column(db.String(40), index=True)
+    #: None once the appraisal is done, otherwise where it is in the queue
+    #: of appraisals waiting for a worker (see jobs.py)
+    Status = db.Column(db.String(20), index=True)
+
+    def summary(self):
+        """ Works out the values for the summary columns from the items.
+            top_value is the total sell value of the representative type. """
+        top_value, top_type_id = 0, None
+        item_count = 0
         for item in self.iter_types():
-            # Don't factor blueprint copies into the total
-            if item.get('bpc'):
-                continue
-
-            if not item.get('market'):
+            item_count += 1
+            if item.get('bpc') or not item['prices']:
                 continue
+            value = item['prices']['sell']['price'] * item['quantity']
+            if top_type_id is None or value > top_value:
+                top_value, top_type_id = value, item['typeID']
+
+        totals = self.totals()
+        return {'sell': totals['sell'],
+                'buy': totals['buy'],
+                'volume': totals['volume'],
+                'item_count': item_count,
+                'top_type_id': top_type_id,
+                'top_value': top_value}
+
+    def set_summary(self, summary=None):
+        "Fills in the summary columns, from summary() by default"
+        if summary is None:
+            summary = self.summary()
+        self.SellTotal = summary['sell']
+        self.BuyTotal = summary['buy']
+        self.Volume = summary['volume']
+        self.ItemCount = summary['item_count']
+        self.RepresentativeTypeId = summary['top_type_id']
 
-            quantity = item.get('quantity') or 1
-            if item['prices']:
-                total_sell += item['prices']['sell']['price'] * quantity
-                total_buy += item['prices']['buy']['price'] * quantity
-            if item.get('volume'):
-                total_volume += item['volume'] * quantity
-
-        return {'sell': total_sell, 'buy': total_buy, 'volume': total_volume}
+    def totals(self):
+        """ Returns the sell, buy and volume totals, and the same totals for
+            each kind of result under 'kinds' """
+        if getattr(self, '_totals', None) is None:
+            self._totals = sum_totals(*self._load_items())
+        return self._totals
 
     def result_list(self):
         """ Returns a structure that looks like this:
@@ -69,21 +122,34 @@ class Appraisals(db.Model):
         return [[self.Kind, self.Parsed]]
 
     def iter_types(self):
-        price_map = dict(self.Prices)
-        for kind, parsed in self.result_list():
-            for item in iter_types(kind, parsed):
-                details = get_type_by_name(item['name'])
-                item['prices'] = None
-                if details:
-                    item.update(details)
-                    item['prices'] = price_map.get(item['typeID'])
-
-                if 'BLUEPRINT COPY' in item.get('details', ''):
-                    item['bpc'] = True
+        return iter(self._load_items()[0])
+
+    def _load_items(self):
+        """ Fills in the details and prices of every item, once per instance.
+            Returns the items and a list with the kind of each one. """
+        if getattr(self, '_items', None) is None:
+            price_map = dict(self.Prices)
+            items = []
+            kinds = []
+            for kind, parsed in self.result_list():
+                for item in iter_types(kind, parsed):
+                    # Leave Parsed as it is, it may still need to be saved
+                    item = dict(item)
+                    details = get_type_by_name(item['name'])
                     item['prices'] = None
+                    if details:
+                        item.update(details)
+                        item['prices'] = price_map.get(item['typeID'])
+
+                    if 'BLUEPRINT COPY' in item.get('details', ''):
+                        item['bpc'] = True
+                        item['prices'] = None
 
-                item['quantity'] = item.get('quantity', 1)
-                yield item
+                    item['quantity'] = item.get('quantity', 1)
+                    items.append(item)
+                    kinds.append(kind)
+            self._items = (items, kinds)
+        return self._items
 
 
 class Users(db.Model):
@@ -94,17 +160,217 @@ class Users(db.Model):
     Options = db.Column(db.Text())
 
 
-def appraisal_count():
-    # Postresql counts are slow.
+def input_hash(lines):
+    """ Identifies a paste by its lines, as split_and_strip() returns them,
+        so differences in whitespace and line endings don't matter """
+    digest = hashlib.sha1()
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+        digest.update('\n')
+    return digest.hexdigest()
+
+
+def find_duplicate(paste_hash, market):
+    """ The newest appraisal of the same paste for market made in the last
+        DEDUP_WINDOW seconds, with its details loaded, or None """
+    window = app.config['DEDUP_WINDOW']
+    if not window:
+        return None
+    q = Appraisals.query.filter(Appraisals.InputHash == paste_hash,
+                                Appraisals.Market == int(market),
+                                Appraisals.ParsedVersion == 1,
+                                Appraisals.Status == None,  # noqa
+                                Appraisals.Created >= time.time() - window)
+    q = q.options(undefer_group('details'))
+    return q.order_by(desc(Appraisals.Created)).first()
+
+
+def latest_query(kind=None, cursor=None):
+    "Public appraisals for /latest, see page_query()"
+    q = Appraisals.query
+    q = q.filter_by(Public=True, Status=None)  # NOQA
+    if kind:
+        q = q.filter_by(Kind=kind)  # NOQA
+    return page_query(q, cursor, app.config['LATEST_PAGE_SIZE'])
+
+
+def history_query(user_id, cursor=None):
+    "A user's appraisals for /history, see page_query()"
+    q = Appraisals.query
+    q = q.filter(Appraisals.UserId == user_id)
+    q = q.filter(Appraisals.Status == None)  # noqa
+    return page_query(q, cursor, app.config['HISTORY_PAGE_SIZE'])
+
+
+def page_query(q, cursor, page_size):
+    """ Orders q newest first and limits it to the page of appraisals that
+        come after cursor (None for the first page). Seeks to the cursor
+        using the Created index instead of an OFFSET, so every page is as
+        fast as the first. One row more than page_size is fetched, pass the
+        results to split_page() to know if there's another page. """
+    if cursor is not None:
+        created, appraisal_id = cursor
+        # The first condition is implied by the second one, but it's the
+        # one that lets the database seek in the Created index
+        q = q.filter(Appraisals.Created <= created)
+        q = q.filter(or_(Appraisals.Created < created,
+                         Appraisals.Id < appraisal_id))
+    q = q.order_by(desc(Appraisals.Created), desc(Appraisals.Id))
+    return q.limit(page_size + 1)
+
+
+def split_page(appraisals, page_size):
+    """ Splits the results of a page_query() into the appraisals to show and
+        the cursor string for the next page, None if this is the last one """
+    if len(appraisals) <= page_size:
+        return appraisals, None
+    last = appraisals[page_size - 1]
+    return appraisals[:page_size], '%d-%d' % (last.Created, last.Id)
+
+
+def parse_cursor(cursor):
+    """ Turns a cursor string from split_page() back into (Created, Id).
+        Raises ValueError for anything split_page() couldn't have made. """
+    if not cursor:
+        return None
+    created, appraisal_id = cursor.split('-')
+    if not (created.isdigit() and appraisal_id.isdigit()):
+        raise ValueError("Invalid cursor: %r" % cursor)
+    created, appraisal_id = int(created), int(appraisal_id)
+    if max(created, appraisal_id) >= 2 ** 63:
+        raise ValueError("Invalid cursor: %r" % cursor)
+    return created, appraisal_id
+
+
+class Counters(db.Model):
+    """ Running counts of appraisals, kept up to date by count_appraisal()
+        so they can be read without counting the Appraisals table. Names are
+        from counter_names(). """
+    __tablename__ = 'Counters'
+
+    Name = db.Column(db.String(100), primary_key=True)
+    Value = db.Column(db.BigInteger(), nullable=False, default=0)
+
+
+def counter_names(kind=None, market=None):
+    """ Returns the name of the counter for all appraisals, followed by the
+        ones for the given kind and market """
+    names = ['appraisals']
+    if kind is not None:
+        names.append('appraisals:kind:%s' % kind)
+    if market is not None:
+        names.append('appraisals:market:%s' % market)
+    return names
+
+
+#: Counters known to exist in the database; they're never removed
+_known_counters = set()
+
+
+def count_appraisal(appraisal):
+    """ Adds a new appraisal to its counters. Call it before committing the
+        appraisal so both are saved together. Counters that don't exist yet
+        are created first by create_counter(). """
+    names = counter_names(appraisal.Kind, appraisal.Market)
+    missing = [name for name in names if name not in _known_counters]
+    if missing:
+        # Flushing now would lock SQLite before the counters are created
+        with db.session.no_autoflush:
+            existing = set(name for name, in db.session.query(Counters.Name)
+                           .filter(Counters.Name.in_(missing)))
+        for name in missing:
+            if name not in existing:
+                create_counter(name)
+            _known_counters.add(name)
+
+    db.session.execute(
+        Counters.__table__.update()
+        .where(Counters.Name.in_(names))
+        .values(Value=Counters.Value + 1))
+
+
+def create_counter(name):
+    """ Inserts counter name, counting the committed appraisals it's for in
+        the same statement, in a transaction of its own. Appraisals that
+        aren't committed yet are left for count_appraisal() to add. Does
+        nothing when another request created it first. """
+    count = select([literal(name), func.count(Appraisals.Id)]).where(
+        and_(*counter_filter(name)))
     try:
-        res = db.engine.execute("""SELECT reltuples
-                                   FROM pg_class r
-                                   WHERE relkind = 'r'
-                                   AND relname = 'Appraisals';""")
-        count = int(res.fetchone()[0])
-    except OperationalError:
-        count = Appraisals.query.count()
-    return count
+        with db.engine.begin() as conn:
+            conn.execute(Counters.__table__.insert().from_select(
+                ['Name', 'Value'], count))
+    except IntegrityError:
+        pass
+
+
+def counter_filter(name):
+    "The criteria for the appraisals counter name is for"
+    criteria = [Appraisals.Status == None]  # noqa
+    parts = name.split(':')
+    if len(parts) == 3 and parts[1] == 'kind':
+        criteria.append(Appraisals.Kind == parts[2])
+    elif len(parts) == 3 and parts[1] == 'market':
+        criteria.append(Appraisals.Market == int(parts[2]))
+    return criteria
+
+
+def count_appraisals(name):
+    "Counts the appraisals that counter name is for, the slow way"
+    q = db.session.query(func.count(Appraisals.Id))
+    return q.filter(*counter_filter(name)).scalar()
+
+
+def reconcile_counters():
+    """ Recounts every counter from the Appraisals table, fixing any drift
+        (from rows added or removed without count_appraisal()), and creates
+        the missing ones. Each counter is locked and recounted by the
+        database in a transaction of its own, so increments made meanwhile
+        aren't lost. Returns {name: (old value, new value)} for the counters
+        that changed. """
+    done = Appraisals.Status == None  # noqa
+    names = set(['appraisals'])
+    for column, label in [(Appraisals.Kind, 'kind'),
+                          (Appraisals.Market, 'market')]:
+        q = db.session.query(column).filter(done).distinct()
+        names.update('appraisals:%s:%s' % (label, value)
+                     for value, in q if value is not None)
+    names.update(name for name, in db.session.query(Counters.Name))
+    db.session.commit()
+
+    changed = {}
+    for name in sorted(names):
+        current = db.session.query(Counters.Value).filter(
+            Counters.Name == name)
+        old = current.with_for_update().scalar()
+        if old is None:
+            db.session.commit()
+            create_counter(name)
+            old = 0
+        else:
+            count = select([func.count(Appraisals.Id)]).where(
+                and_(*counter_filter(name)))
+            db.session.execute(
+                Counters.__table__.update()
+                .where(Counters.Name == name)
+                .values(Value=count.as_scalar()))
+        new = current.scalar()
+        db.session.commit()
+        if new != old:
+            changed[name] = (old, new)
+    return changed
+
+
+def appraisal_count(kind=None, market=None):
+    """ Returns the number of appraisals, only counting the ones of the given
+        kind or market (but not both) if either is set. Falls back to
+        counting the table for kinds and markets that haven't been
+        appraised since the counters were added. """
+    name = counter_names(kind, market)[-1]
+    counter = Counters.query.get(name)
+    if counter is not None:
+        return counter.Value
+    return count_appraisals(name)
 
 
 def row_to_dict(row):
@@ -112,19 +378,68 @@ def row_to_dict(row):
                 for col in row.__table__.columns.keys())
 
 
-TYPES = json.loads(open('data/types.json').read())
-TYPES_BY_NAME = dict((t['typeName'].lower(), t) for t in TYPES)
-TYPES_BY_ID = dict((t['typeID'], t) for t in TYPES)
+_types = None
+_types_lock = threading.Lock()
+
+
+def get_type_database():
+    "Opens the type database on first use"
+    global _types
+    if _types is None:
+        with _types_lock:
+            if _types is None:
+                _types = open_type_database('data/types.json',
+                                            'data/types.db')
+    return _types
+
+
+def preload_types():
+    """ Loads the type data right away instead of on the first lookup. Pre-fork
+        servers should call this (see PRELOAD_TYPES) so that every worker
+        starts with the types already in shared memory. """
+    get_type_database().preload()
+
+
+_missing = object()
+# Lookups by the exact string (or id) given, including the ones that failed
+_types_by_name = LRUCache(maxsize=app.config['TYPE_LOOKUP_CACHE_SIZE'])
+_types_by_id = LRUCache(maxsize=app.config['TYPE_LOOKUP_CACHE_SIZE'])
+_boms_by_id = LRUCache(maxsize=app.config['TYPE_LOOKUP_CACHE_SIZE'])
 
 
 def get_type_by_name(name):
     if not name:
         return
-    s = name.lower().strip()
-    return (TYPES_BY_NAME.get(s.rstrip('*')) or TYPES_BY_NAME.get(s))
+    result = _types_by_name.get(name, _missing)
+    if result is _missing:
+        types = get_type_database()
+        result = (types.get_by_name(normalize_type_name(name)) or
+                  types.get_by_name(name.lower().strip()))
+        _types_by_name.set(name, result)
+    return result
 
 
 def get_type_by_id(typeID):
     if not typeID:
         return
-    return TYPES_BY_ID.get(typeID)
+    result = _types_by_id.get(typeID, _missing)
+    if result is _missing:
+        result = get_type_database().get_by_id(typeID)
+        _types_by_id.set(typeID, result)
+    return result
+
+
+def get_bill_of_materials(typeID):
+    """ The components of a type (from 'components' in types.json) as a tuple
+        of their typeIDs and one of their quantities, or None for types that
+        aren't priced by their components. Worked out once per type. """
+    result = _boms_by_id.get(typeID, _missing)
+    if result is _missing:
+        result = None
+        type_details = get_type_by_id(typeID)
+        if type_details and 'components' in type_details:
+            components = type_details['components']
+            result = (tuple(c['materialTypeID'] for c in components),
+                      tuple(c['quantity'] for c in components))
+        _boms_by_id.set(typeID, result)
+    return result
@@ -0,0 +1,147 @@
+"""
+    Caching for rendered appraisals. A saved appraisal never changes, so a
+    rendered result is cached under its ETag, which is derived from
+    everything that went into it, and kept for RESULT_CACHE_TIMEOUT
+    seconds. A small entry per appraisal (see appraisal_meta()) has what's
+    needed to check access and answer conditional requests, so a 304 or a
+    cached page never has to go to the database for the appraisal.
+
+    The rows of the results table are cached on their own as well (see
+    item_rows()), since the same items show up in many appraisals.
+"""
+import datetime
+import hashlib
+import json
+
+from flask import (g, request, session, make_response,
+                   get_template_attribute)
+from jinja2 import Markup
+
+from . import app, cache
+from filters import is_from_igb
+
+
+def meta_key(appraisal_id):
+    return 'appraisal:meta:%s' % appraisal_id
+
+
+def appraisal_meta(appraisal):
+    "What's cached about an appraisal to serve it without loading it"
+    return {'id': appraisal.Id,
+            'created': appraisal.Created,
+            'public': bool(appraisal.Public),
+            'user_id': appraisal.UserId}
+
+
+def get_meta(appraisal_id):
+    return cache.get(meta_key(appraisal_id))
+
+
+def set_meta(meta):
+    cache.set(meta_key(meta['id']), meta,
+              timeout=app.config['RESULT_CACHE_TIMEOUT'])
+
+
+def can_view(meta):
+    """ Mirrors the Public/UserId filter used when loading an appraisal.
+        Private appraisals that were queued in this session (see
+        remember_queued()) can also be seen, by anonymous users too. """
+    return (meta['public'] or
+            bool(g.user and g.user.Id == meta['user_id']) or
+            meta['id'] in session.get('queued', ()))
+
+
+def remember_queued(appraisal_id):
+    "Lets this session see a queued appraisal once it's done"
+    queued = session.get('queued', [])[-19:]
+    session['queued'] = queued + [appraisal_id]
+
+
+def page_variant():
+    """ The parts of the request that change how a result page looks: the
+        menu differs for signed in users, the paste form depends on the
+        user's options and links differ in the in-game browser. """
+    options = session.get('options') or {}
+    return [bool(g.user), sorted(options.items()), is_from_igb()]
+
+
+def result_etag(meta, kind, variant=None):
+    "A strong ETag for one rendering (kind is 'html' or 'json') of meta"
+    key = json.dumps([app.config['RESULT_CACHE_VERSION'], kind,
+                      meta['id'], meta['created'], variant])
+    return hashlib.sha1(key).hexdigest()
+
+
+def is_not_modified(etag, created):
+    """ True if the client's copy is current. If-Modified-Since is only
+        used when there's no If-None-Match, since the same appraisal can
+        render differently (see page_variant()). """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and created:
+        return (request.if_modified_since >=
+                datetime.datetime.utcfromtimestamp(created))
+    return False
+
+
+def cached_response(body, etag, created, mimetype='text/html'):
+    "Adds the validators (and a 304 status when they match) to body"
+    if is_not_modified(etag, created):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = mimetype
+    response.set_etag(etag)
+    if created:
+        response.last_modified = created
+    # Browsers have to check back since the page depends on the session
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def get_page(etag):
+    return cache.get('page:%s' % etag)
+
+
+def set_page(etag, body):
+    cache.set('page:%s' % etag, body,
+              timeout=app.config['RESULT_CACHE_TIMEOUT'])
+
+
+def row_key(item, igb):
+    "Everything print_row() shows for item"
+    prices = item.get('prices') or {}
+    key = json.dumps([app.config['RESULT_CACHE_VERSION'], igb,
+                      item.get('typeID'), item.get('typeName'),
+                      item.get('name'), item.get('bpc'),
+                      item.get('destroyed'), item.get('quantity'),
+                      item.get('volume'),
+                      [(prices.get(side) or {}).get(field)
+                       for side in ('sell', 'buy')
+                       for field in ('price', 'volume')]],
+                     sort_keys=True)
+    return 'row:%s' % hashlib.sha1(key).hexdigest()
+
+
+@app.template_global()
+def item_rows(items):
+    """ The rendered results table rows for items. Cached rows are fetched
+        with one cache request and only the rest are rendered. """
+    igb = is_from_igb()
+    items = list(items)
+    keys = [row_key(item, igb) for item in items]
+    rows = cache.get_many(*keys) if keys else []
+
+    missing = {}
+    print_row = None
+    for i, (item, key, row) in enumerate(zip(items, keys, rows)):
+        if row is None:
+            if print_row is None:
+                print_row = get_template_attribute('kinds/macros.html',
+                                                   'print_row')
+            row = missing[key] = unicode(print_row(item, igb))
+        rows[i] = Markup(row)
+    if missing:
+        cache.set_many(missing, timeout=app.config['RESULT_CACHE_TIMEOUT'])
+    return rows
@@ -1,78 +1,143 @@
+import threading
 from collections import defaultdict
-from itertools import takewhile
 from re import sub
 
 import evepaste
 from evepaste import parsers
-from models import get_type_by_name
+from evepaste.parsers.eft import EFT_BLACKLIST
+from evepaste.parsers.killmail import TIME_RE
+from evepaste.utils import split_and_strip
+from models import get_type_by_name, get_type_database
 from helpers import iter_types
+from typedb import normalize_type_name
 
 
 def parse(raw_paste):
-    unique_items = set()
-    results = []
-    representative_kind = 'unknown'
-    largest_kind_num = 0
-
+    """ Parses raw_paste, which may contain several different formats.
+
+        The paste is split into blocks at the lines that can only start an
+        EFT fit or a killmail, since those parsers need their header on the
+        first line. Each parser then gets one pass over the lines of each
+        block that the parsers before it couldn't use. Every other parser
+        works line by line, so a parser that found nothing in a set of lines
+        won't find anything in fewer of them; there is no need to go back
+        and retry the parsers that already had their turn.
+    """
+    batch = None
+    for batch in iter_parse(split_and_strip(raw_paste)):
+        pass
+
+    if not batch or not batch['results']:
+        raise evepaste.Unparsable('No valid parser found for the given text.')
+
+    return {'representative_kind': batch['representative_kind'],
+            'results': batch['results'],
+            'bad_lines': batch['bad_lines'],
+            'unique_items': batch['unique_items']}
+
+
+def iter_parse(lines, batch_size=None):
+    """ Parses lines (any iterable) incrementally. A batch is yielded for
+        roughly every batch_size lines consumed, or just one for all of them
+        when batch_size is None. Batches have the same keys as the result of
+        parse() plus representative_count, the item count of the result that
+        decided representative_kind. Unlike parse(), nothing is raised for
+        a batch without any results. """
     parser_list = list(evepaste.PARSER_TABLE) + [
         ('listing', listing_parser),
         ('heuristic', tryhard_parser),
     ]
 
-    iterations = 0
-    while iterations < 10:
-        iterations += 1
-        try:
-            if not parser_list:
+    batch = None
+    line_count = 0
+    for block in split_blocks(lines, batch_size):
+        if batch is None:
+            batch = {'representative_kind': 'unknown',
+                     'representative_count': 0,
+                     'results': [],
+                     'bad_lines': [],
+                     'unique_items': set()}
+        line_count += len(block)
+
+        for kind, parser_func in parser_list:
+            if not block:
                 break
 
-            kind, result, bad_lines = evepaste.parse(raw_paste,
-                                                     parsers=parser_list)
-
-            if result:
-                # Verify the results has some valid items and gather unique
-                # items
-                item_count = 0
-                for item in iter_types(kind, result):
-                    details = get_type_by_name(item['name'])
-                    if details:
-                        unique_items.add(details['typeID'])
-                        item_count += 1
-
-                if item_count == 0:
-                    # Narrow down the parser_list to those that didn't get a
-                    # chance last time
-                    used_parser_list = list(takewhile(lambda p: kind != p[0],
-                                                      parser_list))
-                    parser_list = parser_list[len(used_parser_list)+1:]
-                    continue
-
-                results.append([kind, result])
-
-                # Determine if this is the representative type
-                if item_count >= largest_kind_num:
-                    representative_kind = kind
-                    largest_kind_num = item_count
-
-                raw_paste = '\n'.join(bad_lines)
-            else:
-                # We found zero results, we're done parsing
-                break
+            try:
+                result, remaining_lines = parser_func(block)
+            except evepaste.Unparsable:
+                continue
 
-            # We're finished parsing because we've consumed all of our data
-            if not bad_lines:
-                break
+            if not result:
+                continue
 
-        except evepaste.Unparsable:
-            if results:
-                break
-            else:
-                raise
+            # Verify the results has some valid items and gather unique
+            # items
+            item_count = 0
+            for item in iter_types(kind, result):
+                details = get_type_by_name(item['name'])
+                if details:
+                    batch['unique_items'].add(details['typeID'])
+                    item_count += 1
+
+            if item_count == 0:
+                continue
+
+            batch['results'].append([kind, result])
+
+            # Determine if this is the representative type
+            if item_count >= batch['representative_count']:
+                batch['representative_kind'] = kind
+                batch['representative_count'] = item_count
+
+            block = remaining_lines
+        batch['bad_lines'].extend(block)
+
+        if batch_size and line_count >= batch_size:
+            yield batch
+            batch = None
+            line_count = 0
+
+    if batch is not None:
+        yield batch
 
-    return {'representative_kind': representative_kind,
-            'results': results,
-            'bad_lines': bad_lines,
-            'unique_items': unique_items}
+
+def iter_lines(stream, encoding='utf-8'):
+    """ Reads the lines of a file-like object one at a time, cleaned up the
+        same way as split_and_strip() does it for a whole string. """
+    for line in stream:
+        line = line.decode(encoding, 'replace').rstrip('\n')
+        if line.endswith('\r'):
+            line = line[:-1]
+        line = line.strip(' ').replace(u"\xa0", u"").replace(u"\xc2", u"")
+        if line:
+            yield line
+
+
+def is_block_header(line):
+    "Returns True for the first line of an EFT fit or a killmail"
+    if TIME_RE.search(line):
+        return True
+    return (line.startswith('[') and line.endswith(']') and ',' in line and
+            line.lower() not in EFT_BLACKLIST)
+
+
+def split_blocks(lines, max_lines=None):
+    """ Splits lines into lists that each start at a block header. Blocks that
+        don't start with a header are also cut every max_lines lines; the
+        parsers that can use them all work line by line anyway. """
+    block = []
+    for line in lines:
+        if block and is_block_header(line):
+            yield block
+            block = []
+        elif (max_lines and len(block) >= max_lines and
+                not is_block_header(block[0])):
+            yield block
+            block = []
+        block.append(line)
+    if block:
+        yield block
 
 
 def listing_parser(lines):
@@ -153,13 +218,12 @@ def tryhard_parser(lines):
                 break
         else:
             # The above method failed. Now let's try splitting on spaces and
-            # build each part until we find a valid type
+            # find the longest type name the line starts with
             parts = [part.strip(',\t ') for part in line.split(' ')]
-            for i in range(len(parts)):
-                name = ' '.join(parts[:-i])
-                if name and get_type_by_name(name):
-                    results[name] += 1
-                    break
+            parts = [part for part in parts if part]
+            length = get_name_trie().longest_prefix(parts)
+            if length:
+                results[' '.join(parts[:length])] += 1
             else:
                 bad_lines.append(line)
 
@@ -170,6 +234,50 @@ def tryhard_parser(lines):
             for name, quantity in results.items()], bad_lines
 
 
+class NameTrie(object):
+    """ A trie of every type name, one level per word of the normalized name.
+        Finding the longest name at the start of a line walks it once and
+        stops as soon as no name continues with the next word. """
+    def __init__(self, names):
+        self.root = {}
+        for name in names:
+            node = self.root
+            for word in normalize_type_name(name).split():
+                node = node.setdefault(word, {})
+            # None marks the end of a name
+            node[None] = True
+
+    def longest_prefix(self, words):
+        """ Returns how many of the leading words make up the longest type
+            name, or 0 if they don't start with one. """
+        longest = 0
+        node = self.root
+        for i, word in enumerate(words):
+            word = word.lower()
+            # Trailing stars are ignored, like in get_type_by_name
+            end = node.get(word.rstrip('*'))
+            if end is not None and None in end:
+                longest = i + 1
+            node = node.get(word)
+            if node is None:
+                break
+        return longest
+
+
+_name_trie = None
+_name_trie_lock = threading.Lock()
+
+
+def get_name_trie():
+    "Builds the NameTrie on first use"
+    global _name_trie
+    if _name_trie is None:
+        with _name_trie_lock:
+            if _name_trie is None:
+                _name_trie = NameTrie(get_type_database().iter_names())
+    return _name_trie
+
+
 def int_convert(s):
     try:
         return int(sub(r"[,'\. 'x]", '', s))
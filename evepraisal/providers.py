@@ -0,0 +1,209 @@
+"""
+    Upstream price providers. Each one keeps rolling statistics of its
+    recent calls and a circuit breaker, so a provider that keeps failing is
+    skipped for a while instead of adding its timeout to every appraisal.
+    ProviderRegistry.ordered() puts the providers that have been quickest
+    to give an answer first, once there are enough calls to tell. Since a
+    provider is only asked for what the ones before it couldn't price, the
+    others are probed now and then (see estimate.probe_providers()) so they
+    get their statistics too.
+
+    A provider's fetch function takes (eve_types, options=None,
+    timeout=None, failures=None, cache_results=True) and returns
+    {typeId: pricing_info}. It adds whatever went wrong to the failures
+    list instead of raising, so the prices it did get are still used (see
+    estimate.fetch_chunks()). Probes pass cache_results=False so their
+    prices are only timed, never used.
+"""
+import threading
+import time
+from collections import deque
+
+
+class PriceProvider(object):
+    """ Wraps fetch (and fetch_markets, its version for several markets at
+        once, see estimate.MARKET_BATCHED) with a timeout and the
+        statistics of the last window calls that are less than max_age
+        seconds old. After failure_threshold failed calls in a row the
+        circuit opens and the provider isn't used for reset_timeout
+        seconds. Then a single trial call is let through: the circuit
+        closes if it works and stays open for another reset_timeout if it
+        doesn't. While it has fewer than min_samples recent calls it's
+        probed at most once every probe_interval seconds. """
+    def __init__(self, name, fetch, fetch_markets=None, timeout=15,
+                 failure_threshold=5, reset_timeout=60, window=100,
+                 max_age=600, min_samples=10, probe_interval=30):
+        self.name = name
+        self.fetch = fetch
+        self.fetch_markets = fetch_markets
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        self.probed_at = 0
+        self.probing = False
+        #: (when, seconds taken, whether it worked) for each recent call
+        self.calls = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<PriceProvider %s>' % self.name
+
+    def available(self, now=None):
+        """ False while the circuit is open, unless it's time for a trial
+            call and none is running yet """
+        if self.opened_at is None:
+            return True
+        now = time.time() if now is None else now
+        return (now - self.opened_at >= self.reset_timeout and
+                not self.trial_running)
+
+    def _start_call(self):
+        "Whether a call can be made now, claiming the trial call if it is"
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.available():
+                return False
+            self.trial_running = True
+            return True
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            self.calls.append((time.time(), elapsed, ok))
+            self.trial_running = False
+            if ok:
+                self.consecutive_failures = 0
+                self.opened_at = None
+            else:
+                self.consecutive_failures += 1
+                if (self.opened_at is not None or
+                        self.consecutive_failures >= self.failure_threshold):
+                    self.opened_at = time.time()
+
+    def recent_calls(self):
+        "(seconds taken, whether it worked) for the calls in the window"
+        since = time.time() - self.max_age
+        with self._lock:
+            return [(elapsed, ok) for when, elapsed, ok in self.calls
+                    if when >= since]
+
+    def expected_cost(self):
+        """ Average seconds a call takes, where a failed call costs the full
+            timeout since the next provider still has to be asked. None
+            until there are min_samples recent calls. """
+        calls = self.recent_calls()
+        if not calls or len(calls) < self.min_samples:
+            return None
+        return sum(elapsed if ok else max(elapsed, self.timeout)
+                   for elapsed, ok in calls) / len(calls)
+
+    def stats(self):
+        calls = self.recent_calls()
+        errors = sum(1 for _, ok in calls if not ok)
+        return {'calls': len(calls),
+                'errors': errors,
+                'error_rate': float(errors) / len(calls) if calls else 0,
+                'avg_latency': (sum(elapsed for elapsed, _ in calls) /
+                                len(calls) if calls else 0),
+                'expected_cost': self.expected_cost(),
+                'open': not self.available()}
+
+    def _call(self, fetch, *args, **kwargs):
+        if not self._start_call():
+            return {}
+        failures = []
+        start = time.time()
+        try:
+            result = fetch(*args, timeout=self.timeout, failures=failures,
+                           **kwargs)
+        except Exception:
+            self.record(time.time() - start, False)
+            raise
+        self.record(time.time() - start, not failures)
+        return result
+
+    def needs_probe(self, now=None):
+        "Whether it's time to probe this provider for its statistics"
+        now = time.time() if now is None else now
+        return (not self.probing and
+                now - self.probed_at >= self.probe_interval and
+                self.available(now) and
+                self.expected_cost() is None)
+
+    def start_probe(self):
+        "Claims the next probe, returns False if it's not time for one"
+        with self._lock:
+            if (self.probing or
+                    time.time() - self.probed_at < self.probe_interval):
+                return False
+            self.probing = True
+            self.probed_at = time.time()
+            return True
+
+    def probe(self, eve_types, options=None):
+        """ A call made only to time this provider, after start_probe().
+            The prices aren't cached or returned. """
+        try:
+            self._call(self.fetch, eve_types, options=options,
+                       cache_results=False)
+        finally:
+            self.probing = False
+
+    def __call__(self, eve_types, options=None):
+        "Used like the other pricing methods in estimate.py"
+        return self._call(self.fetch, eve_types, options=options)
+
+    def for_markets(self, eve_types_by_market):
+        "Takes and returns dicts keyed by solarsystem_id"
+        if self.fetch_markets is None:
+            return dict((market, self(eve_types,
+                                      options={'solarsystem_id': market}))
+                        for market, eve_types in eve_types_by_market.items())
+        return self._call(self.fetch_markets, eve_types_by_market)
+
+
+class ProviderRegistry(object):
+    "The price providers, in the order they were registered"
+    def __init__(self):
+        self.providers = []
+        #: Every provider, cheapest first as of the last time all of them
+        #: had an expected_cost()
+        self.order = []
+        #: Provider names in the order ordered() last gave them, kept by
+        #: estimate.ordered_providers()
+        self.last_order = None
+
+    def register(self, provider):
+        self.providers.append(provider)
+        self.order = self.order + [provider]
+        return provider
+
+    def get(self, name):
+        for provider in self.providers:
+            if provider.name == name:
+                return provider
+
+    def ordered(self):
+        """ The available providers, cheapest expected_cost() first. The
+            order is only changed when every provider, available or not,
+            has enough recent calls for one. Until then it stays as it was
+            (the order they were registered in at first), so a provider
+            whose circuit was open doesn't lose its place for good. Ties
+            keep the order they were before. """
+        now = time.time()
+        costs = dict((provider, provider.expected_cost())
+                     for provider in self.providers)
+        if None not in costs.values():
+            self.order = sorted(self.order, key=costs.get)
+        return [provider for provider in self.order
+                if provider.available(now)]
+
+    def stats(self):
+        return dict((provider.name, provider.stats())
+                    for provider in self.providers)
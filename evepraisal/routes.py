@@ -10,6 +10,7 @@ app.route('/', methods=['GET', 'POST'])(views.index)
 app.route('/history')(views.history)
 app.route('/options', methods=['GET', 'POST'])(views.options)
 app.route('/estimate', methods=['POST'])(views.estimate_cost)
+app.route('/estimate/stream', methods=['POST'])(views.estimate_stream)
 app.route('/e/<int:result_id>')(views.display_result)
 app.route('/estimate/<int:result_id>', methods=['GET'])(views.display_result)
 app.route('/latest')(views.latest)
@@ -20,8 +21,13 @@ app.route('/robots.txt')(views.static_from_root)
 app.route('/favicon.ico')(views.static_from_root)
 
 # API Endpoints
-# app.route('/api/v1/estimate', methods=['POST'])(api.estimate_cost)
+app.route('/api/v1/estimate', methods=['POST'],
+          endpoint='api_estimate')(api.estimate_cost)
 app.route('/e/<int:result_id>.json',
           endpoint='api_display')(api.display_result)
 app.route('/estimate/<int:result_id>.json',
           endpoint='api_display')(api.display_result)
+app.route('/e/<int:result_id>/status.json',
+          endpoint='api_status')(api.status)
+app.route('/latest.json', endpoint='api_latest')(api.latest)
+app.route('/history.json', endpoint='api_history')(api.history)
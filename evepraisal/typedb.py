@@ -0,0 +1,130 @@
+"""
+    Lookups for the item type data generated by tools/populate_types.py.
+
+    The preferred source is the SQLite index (data/types.db). It is opened
+    read-only and memory mapped so forked workers share the same pages
+    instead of each holding a copy of every type. When the index isn't
+    there the types are loaded from data/types.json like before.
+
+    This module is imported on its own by tools/bench_types.py, so it must
+    not import anything from the rest of the package.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+#: Bumped whenever the layout written by tools/populate_types.py changes
+INDEX_VERSION = 2
+
+_TYPE_COLUMNS = 'typeID, groupID, typeName, volume, market, components'
+
+
+def normalize_type_name(name):
+    """ Returns the key used to look up a type name: lowercased, with runs of
+        whitespace collapsed and trailing stars (from some in-game lists)
+        removed. Must match tools/populate_types.py. """
+    return ' '.join(name.lower().split()).rstrip('*').rstrip()
+
+
+def name_keys(type_name):
+    "Returns every key a type can be found under"
+    return [normalize_type_name(type_name), type_name.lower()]
+
+
+def _row_to_type(row):
+    type_id, group_id, type_name, volume, market, components = row
+    d = {
+        'typeID': type_id,
+        'groupID': group_id,
+        'typeName': type_name,
+        'volume': volume,
+        'market': bool(market),
+    }
+    if components is not None:
+        d['components'] = json.loads(components)
+    return d
+
+
+class JsonTypeDatabase(object):
+    "Holds every type from types.json in memory"
+    def __init__(self, path):
+        types = json.loads(open(path).read())
+        self.by_name = {}
+        for t in types:
+            for key in name_keys(t['typeName']):
+                self.by_name[key] = t
+        self.by_id = dict((t['typeID'], t) for t in types)
+
+    def get_by_name(self, name):
+        return self.by_name.get(name)
+
+    def get_by_id(self, type_id):
+        return self.by_id.get(type_id)
+
+    def preload(self):
+        "Everything is loaded up front"
+
+    def iter_names(self):
+        return (t['typeName'] for t in self.by_id.itervalues())
+
+
+class SQLiteTypeDatabase(object):
+    """ Queries the types.db index. Connections are opened on first use, one
+        per thread, and are never shared with forked children. """
+    def __init__(self, path, mmap_size=64 * 1024 * 1024):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    def _connection(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.path)
+            conn.execute('PRAGMA query_only = 1')
+            conn.execute('PRAGMA mmap_size = %d' % self.mmap_size)
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def version(self):
+        return self._connection().execute('PRAGMA user_version').fetchone()[0]
+
+    def preload(self):
+        "Reads through both tables to pull the whole file into the page cache"
+        conn = self._connection()
+        conn.execute('SELECT count(components) FROM types').fetchone()
+        conn.execute('SELECT count(nameKey) FROM names').fetchone()
+
+    def iter_names(self):
+        for (name,) in self._connection().execute(
+                'SELECT typeName FROM types'):
+            yield name
+
+    def get_by_name(self, name):
+        row = self._connection().execute(
+            'SELECT %s FROM names JOIN types USING (typeID) '
+            'WHERE nameKey = ?' % _TYPE_COLUMNS, (name,)).fetchone()
+        if row:
+            return _row_to_type(row)
+
+    def get_by_id(self, type_id):
+        row = self._connection().execute(
+            'SELECT %s FROM types WHERE typeID = ?' % _TYPE_COLUMNS,
+            (type_id,)).fetchone()
+        if row:
+            return _row_to_type(row)
+
+
+def open_type_database(json_path, index_path):
+    """ Returns a SQLiteTypeDatabase for index_path if it exists and was built
+        by a compatible version of tools/populate_types.py, otherwise a
+        JsonTypeDatabase for json_path. """
+    if os.path.exists(index_path):
+        db = SQLiteTypeDatabase(index_path)
+        try:
+            if db.version() == INDEX_VERSION:
+                return db
+        except sqlite3.DatabaseError:
+            pass
+    return JsonTypeDatabase(json_path)
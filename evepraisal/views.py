@@ -2,19 +2,29 @@
 """
     An Eve Online Cargo Scanner
 """
+import hashlib
 import time
 import json
 
 from flask import (
     g, flash, request, render_template, url_for, redirect, session,
-    send_from_directory, abort)
-from sqlalchemy import desc
+    send_from_directory, abort, Response, stream_with_context)
+from sqlalchemy.orm import undefer_group
 import evepaste
-
-from helpers import login_required
-from estimate import get_market_prices
-from models import Appraisals, Users, appraisal_count
-from parser import parse
+from evepaste.utils import split_and_strip
+
+from helpers import login_required, stream_template, compared_markets
+from pagecache import (get_meta, set_meta, appraisal_meta, can_view,
+                       remember_queued, page_variant, result_etag,
+                       is_not_modified, cached_response, get_page, set_page)
+from estimate import get_market_prices, get_comparison
+from jobs import QUEUED, appraise
+from aggregate import api_totals, merge_totals
+from filters import get_market_name
+from models import (Appraisals, Users, appraisal_count, count_appraisal,
+                    latest_query, history_query, split_page, parse_cursor,
+                    input_hash, find_duplicate)
+from parser import iter_parse, iter_lines
 from . import app, db, cache, oid
 
 
@@ -27,66 +37,238 @@ def estimate_cost():
     if solar_system not in app.config['VALID_SOLAR_SYSTEMS'].keys():
         abort(400)
 
-    try:
-        parse_results = parse(raw_paste)
-    except evepaste.Unparsable as ex:
-        if raw_paste:
-            app.logger.warning("User input invalid data: %s", raw_paste)
-        return render_template(
-            'error.html', error='Error when parsing input: ' + str(ex))
+    public = bool(session['options'].get('share'))
+    user_id = g.user.Id if g.user else None
+    paste_hash = input_hash(split_and_strip(raw_paste))
 
-    # Populate types with pricing data
-    prices = get_market_prices(list(parse_results['unique_items']),
-                               options={'solarsystem_id': solar_system})
+    duplicate = find_duplicate(paste_hash, solar_system)
+    if (duplicate and duplicate.Public == public and
+            duplicate.UserId == user_id):
+        app.logger.debug("Repeated Appraisal [%s]", duplicate.Id)
+        return render_template('results.html',
+                               appraisal=duplicate)
 
     appraisal = Appraisals(Created=int(time.time()),
                            RawInput=raw_paste,
-                           Kind=parse_results['representative_kind'],
-                           Prices=prices,
-                           Parsed=parse_results['results'],
-                           ParsedVersion=1,
-                           BadLines=parse_results['bad_lines'],
                            Market=solar_system,
-                           Public=bool(session['options'].get('share')),
-                           UserId=g.user.Id if g.user else None)
+                           Public=public,
+                           UserId=user_id,
+                           InputHash=paste_hash)
+    if duplicate:
+        # Someone else's (or differently shared), so it gets a copy
+        appraisal.Kind = duplicate.Kind
+        appraisal.Prices = duplicate.Prices
+        appraisal.Parsed = duplicate.Parsed
+        appraisal.ParsedVersion = 1
+        appraisal.BadLines = duplicate.BadLines
+        appraisal.set_summary()
+    elif app.config['ASYNC_APPRAISALS']:
+        appraisal.Status = QUEUED
+        db.session.add(appraisal)
+        db.session.commit()
+        remember_queued(appraisal.Id)
+        app.logger.debug("Queued Appraisal [%s]", appraisal.Id)
+        return render_template('results_pending.html',
+                               appraisal=appraisal)
+    else:
+        try:
+            appraise(appraisal)
+        except evepaste.Unparsable as ex:
+            if raw_paste:
+                app.logger.warning("User input invalid data: %s", raw_paste)
+            return render_template(
+                'error.html', error='Error when parsing input: ' + str(ex))
+
     db.session.add(appraisal)
+    count_appraisal(appraisal)
     db.session.commit()
 
-    app.logger.debug("New Appraisal [%s]: %s",
-                     appraisal.Id,
-                     parse_results['representative_kind'])
+    app.logger.debug("New Appraisal [%s]: %s", appraisal.Id, appraisal.Kind)
 
     return render_template('results.html',
                            appraisal=appraisal)
 
 
-def display_result(result_id):
-    page = cache.get('appraisal:%s' % result_id)
-    if page:
-        return page
-
-    q = Appraisals.query.filter(Appraisals.Id == result_id)
-    if g.user:
-        q = q.filter((Appraisals.UserId == g.user.Id) |
-                     (Appraisals.Public == True))  # noqa
+def estimate_stream():
+    """ Estimate Cost for pastes that are too big to handle in one go. The
+        paste is either POST[raw_paste] or the whole request body when it's
+        sent as text/plain (market and format are then query arguments).
+
+        Lines are parsed and priced STREAM_BATCH_LINES at a time and every
+        item is sent as soon as its batch is priced. Renders HTML, or
+        newline delimited JSON for format=ndjson. """
+    if request.mimetype == 'text/plain':
+        params = request.args
+        lines = iter_lines(request.stream)
+    else:
+        params = request.form
+        lines = split_and_strip(params.get('raw_paste', ''))
+    solar_system = params.get('market', '30000142')
+
+    if solar_system not in app.config['VALID_SOLAR_SYSTEMS'].keys():
+        abort(400)
+
+    summary = {}
+    items = stream_appraisal(lines, solar_system, summary,
+                             public=bool(session['options'].get('share')),
+                             user_id=g.user.Id if g.user else None)
+
+    if (params.get('format') == 'ndjson' or
+            request.accept_mimetypes.best == 'application/x-ndjson'):
+        return Response(stream_with_context(ndjson_lines(items, summary)),
+                        mimetype='application/x-ndjson')
+
+    return Response(stream_with_context(
+        stream_template('results_stream.html', items=items, summary=summary)))
+
+
+def stream_appraisal(lines, solar_system, summary, public=True, user_id=None):
+    """ Parses and prices lines a batch at a time, yielding each item (as
+        Appraisals.iter_types() would) once it has a price. After the last
+        item the appraisal is saved and summary gets its details, or an
+        'error' if nothing could be parsed. """
+    options = {'solarsystem_id': solar_system}
+    raw_lines = []
+    results = []
+    bad_lines = []
+    prices = {}
+    priced = set()
+    kind, kind_count = 'unknown', 0
+    totals = {}
+    item_count = 0
+    top_value, top_type_id = 0, None
+
+    def record(lines):
+        for line in lines:
+            raw_lines.append(line)
+            yield line
+
+    for batch in iter_parse(record(lines), app.config['STREAM_BATCH_LINES']):
+        results.extend(batch['results'])
+        bad_lines.extend(batch['bad_lines'])
+        if batch['results'] and batch['representative_count'] >= kind_count:
+            kind = batch['representative_kind']
+            kind_count = batch['representative_count']
+
+        new_types = batch['unique_items'] - priced
+        if new_types:
+            prices.update(get_market_prices(list(new_types), options=options))
+            priced.update(new_types)
+
+        partial = Appraisals(Parsed=batch['results'],
+                             ParsedVersion=1,
+                             Prices=[(type_id, prices[type_id])
+                                     for type_id in batch['unique_items']
+                                     if type_id in prices])
+        for item in partial.iter_types():
+            yield item
+        merge_totals(totals, partial.totals())
+        batch_summary = partial.summary()
+        item_count += batch_summary['item_count']
+        if batch_summary['top_type_id'] is not None and (
+                top_type_id is None or batch_summary['top_value'] > top_value):
+            top_value = batch_summary['top_value']
+            top_type_id = batch_summary['top_type_id']
+
+    if not results:
+        if raw_lines:
+            app.logger.warning("User input %s lines of invalid data",
+                               len(raw_lines))
+        summary['error'] = ('Error when parsing input: '
+                            'No valid parser found for the given text.')
+        return
+
+    appraisal = Appraisals(Created=int(time.time()),
+                           RawInput='\n'.join(raw_lines),
+                           InputHash=input_hash(raw_lines),
+                           Kind=kind,
+                           Prices=prices.items(),
+                           Parsed=results,
+                           ParsedVersion=1,
+                           BadLines=bad_lines,
+                           Market=solar_system,
+                           Public=public,
+                           UserId=user_id)
+    appraisal.set_summary({'sell': totals['sell'],
+                           'buy': totals['buy'],
+                           'volume': totals['volume'],
+                           'item_count': item_count,
+                           'top_type_id': top_type_id})
+    db.session.add(appraisal)
+    count_appraisal(appraisal)
+    # Read everything needed before the commit expires the attributes, which
+    # would load the whole appraisal back from the database
+    db.session.flush()
+    summary.update({'id': appraisal.Id,
+                    'kind': kind,
+                    'created': appraisal.Created,
+                    'market_id': int(solar_system),
+                    'market_name': get_market_name(solar_system),
+                    'public': public,
+                    'bad_lines': bad_lines,
+                    'totals': api_totals(totals)})
+    db.session.commit()
+
+    app.logger.debug("New Streamed Appraisal [%s]: %s", summary['id'], kind)
+
+
+def ndjson_lines(items, summary):
+    "Formats the output of stream_appraisal() as newline delimited JSON"
+    for item in items:
+        yield json.dumps({'item': item}) + '\n'
+    if 'error' in summary:
+        yield json.dumps({'error': summary['error']}) + '\n'
     else:
-        q = q.filter(Appraisals.Public == True)  # noqa
+        yield json.dumps({'appraisal': summary}) + '\n'
 
-    appraisal = q.first()
 
-    if not appraisal:
+def display_result(result_id):
+    meta = get_meta(result_id)
+    appraisal = None
+    if meta is None:
+        q = Appraisals.query.filter(Appraisals.Id == result_id)
+        appraisal = q.options(undefer_group('details')).first()
+        if appraisal:
+            meta = appraisal_meta(appraisal)
+            # Nothing is cached until the appraisal is done
+            if appraisal.Status is None:
+                set_meta(meta)
+
+    if not meta or not can_view(meta):
         flash('Resource Not Found', 'error')
         return index(), 404
 
-    page = render_template('results.html',
-                           appraisal=appraisal,
-                           full_page=True)
-    if appraisal.Public:
-        try:
-            cache.set('appraisal:%s' % result_id, page, timeout=30)
-        except Exception:
-            pass
-    return page
+    if appraisal is not None and appraisal.Status is not None:
+        return render_template('results_pending.html',
+                               appraisal=appraisal,
+                               full_page=True)
+
+    # Flashed messages are part of the page and comparisons use the current
+    # prices, so neither page is cached (the comparison itself is, briefly)
+    if '_flashes' in session or request.args.get('compare'):
+        appraisal = appraisal or Appraisals.query.options(
+            undefer_group('details')).get(result_id)
+        markets = compared_markets(appraisal.Market)
+        return render_template('results.html',
+                               appraisal=appraisal,
+                               comparison=(markets and
+                                           get_comparison(appraisal,
+                                                          markets)),
+                               full_page=True)
+
+    etag = result_etag(meta, 'html', page_variant())
+    if is_not_modified(etag, meta['created']):
+        return cached_response('', etag, meta['created'])
+
+    page = get_page(etag)
+    if page is None:
+        appraisal = appraisal or Appraisals.query.options(
+            undefer_group('details')).get(result_id)
+        page = render_template('results.html',
+                               appraisal=appraisal,
+                               full_page=True)
+        set_page(etag, page)
+    return cached_response(page, etag, meta['created'])
 
 
 @login_required
@@ -110,28 +292,45 @@ def options():
 
 @login_required
 def history():
-    q = Appraisals.query
-    q = q.filter(Appraisals.UserId == g.user.Id)
-    q = q.order_by(desc(Appraisals.Created))
-    q = q.limit(100)
-    appraisals = q.all()
+    try:
+        cursor = parse_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+    appraisals, next_cursor = split_page(
+        history_query(g.user.Id, cursor).all(),
+        app.config['HISTORY_PAGE_SIZE'])
+    next_url = None
+    if next_cursor:
+        next_url = url_for('history', before=next_cursor)
 
-    return render_template('history.html', appraisals=appraisals)
+    # Infinite scrolling only asks for the rows of the next page
+    template = 'history_rows.html' if request.args.get('rows') else \
+        'history.html'
+    return render_template(template, appraisals=appraisals, next_url=next_url)
 
 
 def latest():
-    cache_key = "latest:%s" % request.args.get('kind', 'all')
+    kind = request.args.get('kind')
+    try:
+        cursor = parse_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+    template = 'latest_rows.html' if request.args.get('rows') else \
+        'latest.html'
+    # Only normalized values go into the key; kind can be any text
+    cache_key = "latest:%s:%s:%s" % (
+        hashlib.sha1(kind.encode('utf-8')).hexdigest() if kind else 'all',
+        '%d-%d' % cursor if cursor else 'first', template)
     body = cache.get(cache_key)
     if body:
         return body
-    q = Appraisals.query
-    q = q.filter_by(Public=True)  # NOQA
-    if request.args.get('kind'):
-        q = q.filter_by(Kind=request.args.get('kind'))  # NOQA
-    q = q.order_by(desc(Appraisals.Created))
-    q = q.limit(200)
-    appraisals = q.all()
-    body = render_template('latest.html', appraisals=appraisals)
+    appraisals, next_cursor = split_page(latest_query(kind, cursor).all(),
+                                         app.config['LATEST_PAGE_SIZE'])
+    next_url = None
+    if next_cursor:
+        next_url = url_for('latest', kind=kind, before=next_cursor)
+
+    body = render_template(template, appraisals=appraisals, next_url=next_url)
     cache.set(cache_key, body, timeout=30)
     return body
 
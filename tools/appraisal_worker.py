@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Appraises the pastes queued by /estimate when ASYNC_APPRAISALS is on (see
+# evepraisal/jobs.py), using --processes worker processes that each take
+# the oldest queued paste, parse and price it and save the results. Pastes
+# that couldn't be appraised are deleted after FAILED_JOB_RETENTION seconds.
+#
+#   python tools/appraisal_worker.py --processes 4
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal import app, db  # noqa
+from evepraisal.jobs import (claim_job, run_job, requeue_jobs,  # noqa
+                             prune_jobs)
+
+#: Seconds between deleting old failed appraisals, in each worker
+PRUNE_INTERVAL = 60 * 60
+
+
+def work(poll_interval, once=False):
+    "Runs jobs until the queue is empty, then waits for more unless once"
+    pruned_at = 0
+    with app.app_context():
+        while True:
+            try:
+                if time.time() - pruned_at >= PRUNE_INTERVAL:
+                    pruned_at = time.time()
+                    pruned = prune_jobs()
+                    if pruned:
+                        print("[%s] Deleted %s failed appraisals" % (
+                              os.getpid(), pruned))
+                appraisal = claim_job()
+                if appraisal is not None:
+                    start = time.time()
+                    appraisal_id = appraisal.Id
+                    status = run_job(appraisal)
+                    print("[%s] Appraisal %s: %s in %.2fs" % (
+                          os.getpid(), appraisal_id, status,
+                          time.time() - start))
+            except Exception as e:
+                appraisal = None
+                app.logger.exception(e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            if appraisal is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Appraise queued pastes')
+    parser.add_argument('--processes', type=int, default=2,
+                        help='number of worker processes')
+    parser.add_argument('--poll-interval', type=float, default=0.5,
+                        help='seconds to wait when the queue is empty')
+    parser.add_argument('--requeue', action='store_true',
+                        help='first queue the appraisals that were being '
+                             'worked on again (after a crash)')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='with --requeue, also queue the appraisals that '
+                             'failed with an error again')
+    parser.add_argument('--once', action='store_true',
+                        help='exit once the queue is empty')
+    args = parser.parse_args()
+
+    if args.requeue:
+        with app.app_context():
+            print("Requeued %s appraisals" % requeue_jobs(
+                failed=args.retry_failed))
+            db.session.remove()
+
+    # Connections can't be shared with the worker processes
+    db.engine.dispose()
+    workers = [multiprocessing.Process(target=work,
+                                       args=(args.poll_interval, args.once))
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Compares pricing a batch of componentized types (capital ships) one at a
+# time, the way get_componentized_values() used to, with the current way:
+# the components of all of them priced in one pass and summed with
+# aggregate.sum_components(). Uses made up bills of materials and prices;
+# --latency is added to every pricing pass to stand in for a cache or
+# upstream lookup.
+#
+#   python tools/bench_components.py --hulls 50 --latency 0.02
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal import aggregate  # noqa
+
+
+class PriceLookup(object):
+    "Stands in for get_market_prices(), counting the passes made"
+    def __init__(self, prices, latency):
+        self.prices = prices
+        self.latency = latency
+        self.passes = 0
+
+    def __call__(self, type_ids):
+        self.passes += 1
+        time.sleep(self.latency)
+        return dict((type_id, self.prices[type_id]) for type_id in type_ids
+                    if type_id in self.prices)
+
+
+def fake_boms(hull_count, component_count, components_per_hull):
+    "Bills of materials for hull_count hulls and prices for their components"
+    random.seed(1)
+    component_ids = range(100000, 100000 + component_count)
+    boms = {}
+    for hull_id in range(1, hull_count + 1):
+        ids = random.sample(component_ids, components_per_hull)
+        boms[hull_id] = (tuple(ids), tuple(random.randint(1, 100000)
+                                           for _ in ids))
+    prices = {}
+    for component_id in component_ids:
+        price = random.uniform(1, 100000)
+        prices[component_id] = dict(
+            (market_type, {'avg': price, 'min': price, 'max': price,
+                           'price': price})
+            for market_type in ('buy', 'sell', 'all'))
+    return boms, prices
+
+
+def legacy_componentized(boms, lookup):
+    "get_componentized_values() before bills of materials, for comparison"
+    componentized_items = {}
+    for hull_id, (ids, quantities) in boms.items():
+        component_types = dict(zip(ids, quantities))
+        price_map = lookup(component_types.keys())
+        zeroed_price = {'avg': 0, 'min': 0, 'max': 0, 'price': 0}
+        complete_price_data = {
+            'buy': zeroed_price.copy(),
+            'sell': zeroed_price.copy(),
+            'all': zeroed_price.copy(),
+        }
+        for component, quantity in component_types.items():
+            for market_type in ['buy', 'sell', 'all']:
+                for stat in ['avg', 'min', 'max', 'price']:
+                    _price = price_map.get(component)
+                    if _price:
+                        complete_price_data[market_type][stat] += (
+                            _price[market_type][stat] * quantity)
+        componentized_items[hull_id] = complete_price_data
+    return componentized_items
+
+
+def batched_componentized(boms, lookup, use_numpy=True):
+    component_ids = set(component_id for ids, _ in boms.values()
+                        for component_id in ids)
+    return aggregate.sum_components(boms, lookup(list(component_ids)),
+                                    use_numpy=use_numpy)
+
+
+def same_prices(a, b):
+    return all(abs(a[type_id][market_type][stat] -
+                   b[type_id][market_type][stat]) <=
+               1e-9 * max(abs(a[type_id][market_type][stat]), 1)
+               for type_id in a
+               for market_type, stat in aggregate.PRICE_STATS)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark pricing componentized types')
+    parser.add_argument('--hulls', type=int, action='append',
+                        help='componentized types (default: 1, 20, 200)')
+    parser.add_argument('--components', type=int, default=300,
+                        help='distinct component types')
+    parser.add_argument('--per-hull', type=int, default=40,
+                        help='components in each bill of materials')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds added to each pricing pass')
+    args = parser.parse_args()
+
+    print("numpy: %s" % (aggregate.numpy.__version__
+                         if aggregate.numpy else 'not installed'))
+    print("%-8s %-14s %8s %10s" % ('hulls', 'version', 'passes', 'ms'))
+    for hull_count in args.hulls or [1, 20, 200]:
+        boms, prices = fake_boms(hull_count, args.components, args.per_hull)
+        results = []
+        for name, func in [
+                ('old', legacy_componentized),
+                ('python', lambda boms, lookup: batched_componentized(
+                    boms, lookup, use_numpy=False)),
+                ('numpy', batched_componentized)]:
+            if name == 'numpy' and aggregate.numpy is None:
+                continue
+            lookup = PriceLookup(prices, args.latency)
+            start = time.time()
+            results.append(func(boms, lookup))
+            print("%-8d %-14s %8d %10.2f" % (
+                  hull_count, name, lookup.passes,
+                  (time.time() - start) * 1000))
+        print("%-8s prices match: %s" % ('', all(
+              same_prices(results[0], result) for result in results[1:])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Benchmarks upstream price fetching against a local stub market server, so
+# it can be ran offline. Compares the pooled keep-alive client against a new
+# urllib2 connection per call.
+#
+#   python tools/bench_http.py --calls 50 --connect-latency 0.05
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import urllib2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_market_server import StubMarketServer, MARKETSTAT_PATH  # noqa
+from evepraisal import app  # noqa
+from evepraisal.httpclient import HTTPClient  # noqa
+
+
+def bench(name, fetch, urls):
+    start = time.time()
+    for url in urls:
+        fetch(url)
+    elapsed = time.time() - start
+    print("%-10s %d calls in %.3fs (%.2fms/call)"
+          % (name, len(urls), elapsed, elapsed / len(urls) * 1000))
+
+
+def urllib2_fetch(url):
+    request = urllib2.Request(url)
+    request.add_header('User-Agent', app.config['USER_AGENT'])
+    return urllib2.build_opener().open(request).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark upstream HTTP calls against a stub server')
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--types', type=int, default=100,
+                        help='typeIds per call')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated time to produce each response')
+    parser.add_argument('--connect-latency', type=float, default=0.02,
+                        help='simulated TCP/DNS setup time per connection')
+    args = parser.parse_args()
+
+    server = StubMarketServer(latency=args.latency,
+                              connect_latency=args.connect_latency).start()
+    query = '&'.join('typeid=%s' % i for i in range(1, args.types + 1))
+    urls = ['%s%s?%s' % (server.base_url, MARKETSTAT_PATH, query)
+            ] * args.calls
+
+    bench('urllib2', urllib2_fetch, urls)
+    print("  server: %(connections)s connections, %(requests)s requests"
+          % server.stats)
+
+    server.stats.update(connections=0, requests=0)
+    client = HTTPClient(pool_size=app.config['HTTP_POOL_SIZE'],
+                        user_agent=app.config['USER_AGENT'])
+    bench('pooled', client.get, urls)
+    print("  server: %(connections)s connections, %(requests)s requests"
+          % server.stats)
+    print("  client: %(new)s new, %(reused)s reused, %(errors)s errors"
+          % client.stats)
+    client.close()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Compares ways of encoding the JSON columns of Appraisals (Parsed, Prices
+# and BadLines) on the most recent rows of the app's database: time to
+# encode and decode them all and the space they take.
+#
+#   python tools/bench_json_codec.py --rows 2000
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal import app, db, jsoncodec  # noqa
+from evepraisal.models import Appraisals, json_codec  # noqa
+
+COLUMNS = ('Parsed', 'Prices', 'BadLines')
+
+
+def load_values(row_count):
+    "Returns the decoded values of the JSON columns of the latest rows"
+    q = db.session.query(*[getattr(Appraisals, column) for column in COLUMNS])
+    q = q.order_by(Appraisals.Id.desc()).limit(row_count)
+    values = []
+    for row in q:
+        values.extend(row)
+    return values
+
+
+def bench(name, codec, values, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        encoded = [codec.dumps(value) for value in values]
+    encode_time = (time.time() - start) / repeat
+
+    start = time.time()
+    for _ in range(repeat):
+        decoded = [codec.loads(text) for text in encoded]
+    decode_time = (time.time() - start) / repeat
+
+    assert decoded == values, "%s didn't round trip" % name
+    print("%-22s %10.2f %10.2f %12d" % (
+          name, encode_time * 1000, decode_time * 1000,
+          sum(len(text) for text in encoded)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the JSON column encodings')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        values = load_values(args.rows)
+    if not values:
+        print("No appraisals in %s" % app.config['SQLALCHEMY_DATABASE_URI'])
+        return
+
+    print("%d rows, ujson: %s" % (
+          len(values) / len(COLUMNS),
+          jsoncodec.ujson.__version__ if jsoncodec.ujson else 'not installed'))
+    print("%-22s %10s %10s %12s" % (
+          'codec', 'enc (ms)', 'dec (ms)', 'bytes'))
+    codecs = [
+        ('json', jsoncodec.JsonCodec(compress_threshold=None, fast=False)),
+        ('json+zlib', jsoncodec.JsonCodec(fast=False)),
+    ]
+    if jsoncodec.ujson:
+        codecs += [
+            ('ujson', jsoncodec.JsonCodec(compress_threshold=None)),
+            ('ujson+zlib', jsoncodec.JsonCodec()),
+            ('ujson+zlib (all)', jsoncodec.JsonCodec(compress_threshold=0)),
+        ]
+    codecs.append(('configured', json_codec))
+    for name, codec in codecs:
+        bench(name, codec, values, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
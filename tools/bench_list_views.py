@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Compares the queries behind /latest and /history with and without the
+# large Appraisals columns (RawInput, Parsed, Prices and BadLines): the
+# number of SQL statements it takes to render each page, the bytes of
+# column data fetched and the time taken. Uses the app's database.
+#
+#   python tools/bench_list_views.py --repeat 10
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import g, render_template  # noqa
+from sqlalchemy import event, func  # noqa
+from sqlalchemy.orm import undefer_group  # noqa
+
+from evepraisal import app, db  # noqa
+from evepraisal.models import Appraisals, latest_query, history_query  # noqa
+
+
+class StatementCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def fetched_bytes(q):
+    "Bytes of column data in the rows q returns"
+    total = 0
+    for row in db.session.execute(q.statement):
+        for value in row:
+            if value is not None:
+                total += len(value) if isinstance(value, basestring) else 8
+    return total
+
+
+def render(template, q):
+    appraisals = q.all()
+    return render_template(template, appraisals=appraisals)
+
+
+def bench(name, template, q, repeat):
+    counter = StatementCounter()
+    best = None
+    for _ in range(repeat):
+        # Start from an empty session so no rows are already loaded
+        db.session.expunge_all()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+        start = time.time()
+        render(template, q)
+        elapsed = time.time() - start
+        event.remove(db.engine, 'before_cursor_execute', counter)
+        best = elapsed if best is None else min(best, elapsed)
+    print("%-24s %8d %12d %10.2f" % (
+          name, counter.count / repeat, fetched_bytes(q), best * 1000))
+
+
+def busiest_user():
+    q = db.session.query(Appraisals.UserId)
+    q = q.filter(Appraisals.UserId != None)  # noqa
+    q = q.group_by(Appraisals.UserId)
+    q = q.order_by(func.count(Appraisals.Id).desc())
+    row = q.first()
+    return row[0] if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the appraisal list pages')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--user-id', type=int,
+                        help='user for /history (default: the one with the '
+                             'most appraisals)')
+    args = parser.parse_args()
+
+    with app.test_request_context():
+        g.user = None
+        user_id = args.user_id or busiest_user()
+        if user_id is None:
+            print("No appraisals by signed in users, /history is shown "
+                  "with the anonymous ones")
+
+        print("%-24s %8s %12s %10s" % ('query', 'queries', 'bytes', 'ms'))
+        for page, template, q in [
+                ('latest', 'latest.html', latest_query()),
+                ('history', 'history.html', history_query(user_id))]:
+            bench('%s (full rows)' % page, template,
+                  q.options(undefer_group('details')), args.repeat)
+            bench('%s (summary)' % page, template, q, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Times evepraisal.parser.parse on the sample pastes in paste_corpus.py and
+# compares it with the old parser, which re-ran evepaste.parse over the
+# leftover lines up to 10 times. Needs the type data in data/, like the app.
+#
+#   python tools/bench_parser.py --copies 1 --copies 200
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+from itertools import takewhile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evepaste  # noqa
+
+from evepraisal.helpers import iter_types  # noqa
+from evepraisal.models import get_type_by_name  # noqa
+from evepraisal.parser import parse, listing_parser, tryhard_parser  # noqa
+from paste_corpus import CORPUS, build_paste  # noqa
+
+
+def legacy_parse(raw_paste):
+    "The parser before the single pass engine, kept for comparison"
+    unique_items = set()
+    results = []
+    representative_kind = 'unknown'
+    largest_kind_num = 0
+
+    parser_list = list(evepaste.PARSER_TABLE) + [
+        ('listing', listing_parser),
+        ('heuristic', tryhard_parser),
+    ]
+
+    iterations = 0
+    while iterations < 10:
+        iterations += 1
+        try:
+            if not parser_list:
+                break
+
+            kind, result, bad_lines = evepaste.parse(raw_paste,
+                                                     parsers=parser_list)
+
+            if result:
+                item_count = 0
+                for item in iter_types(kind, result):
+                    details = get_type_by_name(item['name'])
+                    if details:
+                        unique_items.add(details['typeID'])
+                        item_count += 1
+
+                if item_count == 0:
+                    used_parser_list = list(takewhile(lambda p: kind != p[0],
+                                                      parser_list))
+                    parser_list = parser_list[len(used_parser_list)+1:]
+                    continue
+
+                results.append([kind, result])
+
+                if item_count >= largest_kind_num:
+                    representative_kind = kind
+                    largest_kind_num = item_count
+
+                raw_paste = '\n'.join(bad_lines)
+            else:
+                break
+
+            if not bad_lines:
+                break
+
+        except evepaste.Unparsable:
+            if results:
+                break
+            else:
+                raise
+
+    return {'representative_kind': representative_kind,
+            'results': results,
+            'bad_lines': bad_lines,
+            'unique_items': unique_items}
+
+
+def timed(func, paste, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        try:
+            result = func(paste)
+        except evepaste.Unparsable:
+            result = None
+    return result, (time.time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the paste parser against the old one')
+    parser.add_argument('--copies', type=int, action='append',
+                        help='times each sample is repeated (default: 1, 100)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print("%-14s %6s %6s %10s %10s %8s" % (
+          'paste', 'copies', 'lines', 'old (ms)', 'new (ms)', 'same'))
+    for copies in args.copies or [1, 100]:
+        for name, text in CORPUS:
+            paste = build_paste(text, copies)
+            old, old_time = timed(legacy_parse, paste, args.repeat)
+            new, new_time = timed(parse, paste, args.repeat)
+            print("%-14s %6d %6d %10.2f %10.2f %8s" % (
+                  name, copies, len(paste.splitlines()),
+                  old_time * 1000, new_time * 1000, old == new))
+
+
+if __name__ == '__main__':
+    main()
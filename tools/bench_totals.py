@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# Times Appraisals.totals() on a large made up appraisal and compares it
+# with the old version, which looked up every item again on each call. A
+# result page calls totals() and iter_types() once each and the JSON API
+# does the same, so "per view" is one of each. Needs the type data in data/,
+# like the app.
+#
+#   python tools/bench_totals.py --items 20000
+
+from __future__ import print_function
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal import aggregate  # noqa
+from evepraisal.helpers import iter_types  # noqa
+from evepraisal.models import (Appraisals, get_type_by_name,  # noqa
+                               get_type_database)
+
+KINDS = ('assets', 'cargo_scan', 'listing', 'contract')
+
+
+def legacy_iter_types(appraisal):
+    "Appraisals.iter_types before the items were kept, for comparison"
+    price_map = dict(appraisal.Prices)
+    for kind, parsed in appraisal.result_list():
+        for item in iter_types(kind, parsed):
+            details = get_type_by_name(item['name'])
+            item['prices'] = None
+            if details:
+                item.update(details)
+                item['prices'] = price_map.get(item['typeID'])
+
+            if 'BLUEPRINT COPY' in item.get('details', ''):
+                item['bpc'] = True
+                item['prices'] = None
+
+            item['quantity'] = item.get('quantity', 1)
+            yield item
+
+
+def legacy_totals(appraisal):
+    "Appraisals.totals before aggregate.py, for comparison"
+    total_sell = total_buy = total_volume = 0
+
+    for item in legacy_iter_types(appraisal):
+        if item.get('bpc'):
+            continue
+
+        if not item.get('market'):
+            continue
+
+        quantity = item.get('quantity') or 1
+        if item['prices']:
+            total_sell += item['prices']['sell']['price'] * quantity
+            total_buy += item['prices']['buy']['price'] * quantity
+        if item.get('volume'):
+            total_volume += item['volume'] * quantity
+
+    return {'sell': total_sell, 'buy': total_buy, 'volume': total_volume}
+
+
+def fake_appraisal(item_count):
+    "An appraisal with item_count items spread over a few kinds of results"
+    random.seed(1)
+    names = list(get_type_database().iter_names())
+    results = dict((kind, []) for kind in KINDS)
+    prices = {}
+    for i in range(item_count):
+        name = random.choice(names)
+        results[KINDS[i % len(KINDS)]].append(
+            {'name': name, 'quantity': random.randint(1, 10000)})
+        details = get_type_by_name(name)
+        if details and details['typeID'] not in prices:
+            sell = random.uniform(1, 1000000)
+            prices[details['typeID']] = {
+                'all': {'avg': sell, 'min': sell, 'max': sell, 'price': sell},
+                'buy': {'avg': sell, 'min': sell, 'max': sell,
+                        'price': sell * 0.9, 'volume': 1},
+                'sell': {'avg': sell, 'min': sell, 'max': sell,
+                         'price': sell, 'volume': 1}}
+    return Appraisals(Kind='assets',
+                      Parsed=[[kind, results[kind]] for kind in KINDS],
+                      ParsedVersion=1,
+                      Prices=prices.items())
+
+
+def fresh_copy(template):
+    "A copy of template that hasn't had its items looked up yet"
+    return Appraisals(Kind=template.Kind,
+                      Parsed=copy.deepcopy(template.Parsed),
+                      ParsedVersion=template.ParsedVersion,
+                      Prices=template.Prices)
+
+
+def timed(func, template, repeat):
+    "Runs func on fresh copies of template, returning the best time"
+    best = None
+    for _ in range(repeat):
+        appraisal = fresh_copy(template)
+        start = time.time()
+        result = func(appraisal)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def legacy_view(appraisal):
+    list(legacy_iter_types(appraisal))
+    return legacy_totals(appraisal)
+
+
+def new_view(appraisal):
+    list(appraisal.iter_types())
+    return appraisal.totals()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark appraisal totals against the old version')
+    parser.add_argument('--items', type=int, action='append',
+                        help='items in the appraisal (default: 10000, 50000)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print("numpy: %s" % (aggregate.numpy.__version__
+                         if aggregate.numpy else 'not installed'))
+    for item_count in args.items or [10000, 50000]:
+        template = fake_appraisal(item_count)
+        # Warm up the type lookup cache so both versions get the same hits
+        legacy_view(fresh_copy(template))
+
+        old, old_time = timed(legacy_view, template, args.repeat)
+        new, new_time = timed(new_view, template, args.repeat)
+        print("%d items" % item_count)
+        print("  per view       old %8.2fms  new %8.2fms" % (
+              old_time * 1000, new_time * 1000))
+        print("  totals match   %s" % all(
+              abs(old[key] - new[key]) <= 1e-6 * max(abs(old[key]), 1)
+              for key in aggregate.TOTAL_KEYS))
+
+        items, kinds = fresh_copy(template)._load_items()
+        columns = aggregate.item_columns(items, kinds)
+        for name, func in [('python', aggregate._python_totals),
+                           ('numpy', aggregate._numpy_totals)]:
+            if name == 'numpy' and aggregate.numpy is None:
+                continue
+            start = time.time()
+            for _ in range(args.repeat):
+                func(columns)
+            print("  sum %-10s %8.2fms" % (
+                  name, (time.time() - start) * 1000 / args.repeat))
+        start = time.time()
+        for _ in range(args.repeat):
+            aggregate.item_columns(items, kinds)
+        print("  item_columns   %8.2fms" % (
+              (time.time() - start) * 1000 / args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Measures how many lines per second the heuristic parser (tryhard_parser)
+# gets through, compared with the old version that probed
+# get_type_by_name with ever shorter prefixes of each line. Needs the type
+# data in data/, like the app.
+#
+#   python tools/bench_tryhard.py --lines 5000
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import evepaste  # noqa
+
+from evepraisal.models import get_type_by_name, get_type_database  # noqa
+from evepraisal.parser import tryhard_parser, get_name_trie, int_convert  # noqa
+
+FILLER = ('from', 'the', 'hangar', 'of', 'my', 'alt', 'please', 'price',
+          'check', 'these', 'units', 'left', 'over', 'after', 'the', 'op')
+
+
+def legacy_tryhard_parser(lines):
+    "tryhard_parser before the name trie, kept for comparison"
+    results = defaultdict(int)
+    bad_lines = []
+
+    for line in lines:
+        parts = [part.strip(', ') for part in line.split('\t')]
+        if len(parts) == 1:
+            parts = [part.strip(',\t ') for part in line.split('  ')]
+            parts = [part for part in parts if part]
+
+        if len(parts) == 1:
+            parts = [part.strip(',') for part in line.split(' ')]
+            parts = [part for part in parts if part]
+
+        if len(parts) == 1:
+            break
+
+        combinations = [['name', 'quantity'],
+                        [None, 'name', None, 'quantity'],
+                        ['quantity', None, 'name'],
+                        ['quantity', 'name'],
+                        [None, 'name'],
+                        ['name']]
+        for combo in combinations:
+            if len(combo) > len(parts):
+                continue
+
+            name = ''
+            quantity = 1
+            for i, part in enumerate(combo):
+                if part == 'name':
+                    if get_type_by_name(parts[i]):
+                        name = parts[i]
+                    else:
+                        break
+                elif part == 'quantity':
+                    if int_convert(parts[i]):
+                        quantity = int_convert(parts[i])
+                    else:
+                        break
+            else:
+                results[name] += quantity
+                break
+        else:
+            parts = [part.strip(',\t ') for part in line.split(' ')]
+            for i in range(len(parts)):
+                name = ' '.join(parts[:-i])
+                if name and get_type_by_name(name):
+                    results[name] += 1
+                    break
+            else:
+                bad_lines.append(line)
+
+    if not results:
+        raise evepaste.Unparsable('No valid input')
+
+    return [{'name': name, 'quantity': quantity}
+            for name, quantity in results.items()], bad_lines
+
+
+def free_text_lines(count, words):
+    "Lines that start with a type name followed by a bunch of free text"
+    random.seed(1)
+    names = list(get_type_database().iter_names())
+    lines = []
+    for i in range(count):
+        filler = ' '.join(random.choice(FILLER) for _ in range(words))
+        if i % 4 == 3:
+            lines.append('%s %s' % (filler, random.choice(names)))
+        else:
+            lines.append('%s %s' % (random.choice(names), filler))
+    return lines
+
+
+def bench(name, func, lines):
+    start = time.time()
+    results, bad_lines = func(lines)
+    elapsed = time.time() - start
+    print("%-8s %8.0f lines/s  (%d types, %d bad lines)" % (
+          name, len(lines) / elapsed, len(results), len(bad_lines)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the heuristic parser')
+    parser.add_argument('--lines', type=int, default=5000)
+    parser.add_argument('--words', type=int, default=12,
+                        help='words of free text per line')
+    args = parser.parse_args()
+
+    lines = free_text_lines(args.lines, args.words)
+    start = time.time()
+    get_name_trie()
+    print("trie built in %.2fs" % (time.time() - start))
+
+    # Each run gets lines it hasn't seen so the lookup cache doesn't favour
+    # whichever runs second
+    bench('old', legacy_tryhard_parser, lines)
+    bench('trie', tryhard_parser, [line + ' x' for line in lines])
+
+
+if __name__ == '__main__':
+    main()
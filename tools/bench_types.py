@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Compares startup time, memory use and lookup speed of the two type
+# database backends: loading data/types.json into dicts vs. querying the
+# SQLite index written by tools/populate_types.py. Each backend is measured
+# in a fresh process.
+#
+#   python tools/bench_types.py
+#   python tools/bench_types.py --json data/types.json --index data/types.db
+
+from __future__ import print_function
+
+import argparse
+import imp
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+TYPEDB_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'evepraisal', 'typedb.py')
+
+
+def rss_kb():
+    "Current resident set size in KB (peak RSS where /proc isn't available)"
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(backend, json_path, index_path, lookups):
+    # Loaded straight from the file so the app (and its type loading) isn't
+    # imported along with it
+    typedb = imp.load_source('typedb', TYPEDB_PATH)
+    with open(json_path) as f:
+        names = [t['typeName'].lower() for t in json.load(f)]
+    random.seed(1)
+    sample = [random.choice(names) for _ in range(lookups)]
+
+    rss_before = rss_kb()
+    start = time.time()
+    if backend == 'json':
+        db = typedb.JsonTypeDatabase(json_path)
+    else:
+        db = typedb.SQLiteTypeDatabase(index_path)
+    db.get_by_id(34)
+    load_time = time.time() - start
+
+    start = time.time()
+    for name in sample:
+        db.get_by_name(name)
+    lookup_time = time.time() - start
+
+    print(json.dumps({'load_time': load_time,
+                      'lookup_time': lookup_time,
+                      'rss_kb': rss_kb() - rss_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the type database backends')
+    parser.add_argument('--json', default='data/types.json')
+    parser.add_argument('--index', default='data/types.db')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--child', choices=['json', 'sqlite'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.json, args.index, args.lookups)
+        return
+
+    for backend in ['json', 'sqlite']:
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--child', backend,
+             '--json', args.json, '--index', args.index,
+             '--lookups', str(args.lookups)])
+        result = json.loads(output)
+        print("%-7s load: %7.1fms  RSS: %7dKB  %d name lookups: %7.1fms" % (
+              backend,
+              result['load_time'] * 1000,
+              result['rss_kb'],
+              args.lookups,
+              result['lookup_time'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
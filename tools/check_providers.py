@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Drives get_prices_for_markets() with local fake price providers (see
+# evepraisal/providers.py) and checks how the registry handles them: a
+# failing provider's circuit opens and it stops being called, only one
+# trial call is let through once it's time to try it again, and a slow
+# provider that prices every type is moved behind a faster one once
+# probing the faster one gave enough calls to compare. Nothing is fetched
+# from the real price APIs.
+#
+#   python tools/check_providers.py --latency 0.05
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal.estimate import get_prices_for_markets  # noqa
+from evepraisal.providers import PriceProvider, ProviderRegistry  # noqa
+
+TYPE_IDS = range(1, 21)
+MARKETS = ['30000142', '30002187']
+
+
+class FakeFetch(object):
+    """ A price API that takes latency seconds, prices every type at price
+        and fails while failing is set """
+    def __init__(self, latency=0, price=1.0, failing=False):
+        self.latency = latency
+        self.price = price
+        self.failing = failing
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return not self.failing
+
+    def _prices(self, eve_types):
+        return dict((type_id, {'all': {'price': self.price}})
+                    for type_id in eve_types)
+
+    def __call__(self, eve_types, options=None, timeout=None, failures=None,
+                 cache_results=True):
+        if not self._start():
+            failures.append(IOError("fake provider is down"))
+            return {}
+        return self._prices(eve_types)
+
+    def markets(self, eve_types_by_market, timeout=None, failures=None):
+        "The fetch_markets version, one call for every market"
+        if not self._start():
+            failures.append(IOError("fake provider is down"))
+            return {}
+        return dict((market, self._prices(eve_types))
+                    for market, eve_types in eve_types_by_market.items())
+
+
+def lookup(registry):
+    "Prices TYPE_IDS in MARKETS with only the registry's providers"
+    return get_prices_for_markets(TYPE_IDS, MARKETS, pricing_methods=[],
+                                  providers=registry)
+
+
+def priced(prices):
+    "How many (market, type) pairs got a price"
+    return sum(len(market_prices) for market_prices in prices.values())
+
+
+def prices_from(prices, fetch):
+    "Whether every price came from fetch"
+    return all(pricing_info['all']['price'] == fetch.price
+               for market_prices in prices.values()
+               for pricing_info in market_prices.values())
+
+
+def order(registry):
+    return [provider.name for provider in registry.ordered()]
+
+
+def check(name, ok):
+    print("%-60s %s" % (name, 'ok' if ok else 'FAILED'))
+    return ok
+
+
+def check_breaker(args):
+    down = FakeFetch(latency=0.02, failing=True)
+    backup = FakeFetch()
+    registry = ProviderRegistry()
+    registry.register(PriceProvider('down', down, down.markets, timeout=1,
+                                    failure_threshold=args.failures,
+                                    reset_timeout=args.reset))
+    registry.register(PriceProvider('backup', backup, backup.markets))
+
+    results = [check("every type is priced by the backup provider",
+                     all(priced(lookup(registry)) ==
+                         len(TYPE_IDS) * len(MARKETS)
+                         for _ in range(args.failures)))]
+    results.append(check("circuit opens after %d failed calls" % args.failures,
+                         order(registry) == ['backup']))
+    calls = down.calls
+    lookup(registry)
+    results.append(check("no calls while the circuit is open",
+                         down.calls == calls))
+
+    time.sleep(args.reset)
+    threads = [threading.Thread(target=lookup, args=(registry,))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.append(check("a single trial call after %ss, from 8 lookups"
+                         % args.reset, down.calls == calls + 1))
+    results.append(check("circuit opens again after the trial call fails",
+                         order(registry) == ['backup']))
+
+    down.failing = False
+    time.sleep(args.reset)
+    lookup(registry)
+    results.append(check("circuit closes after a trial call works",
+                         order(registry) == ['down', 'backup']))
+    return results
+
+
+def check_ordering(args):
+    # Both price every type, so the fast provider is never asked for
+    # leftovers and only gets calls from probes
+    slow = FakeFetch(latency=args.latency, price=1.0)
+    fast = FakeFetch(latency=args.latency / 10, price=2.0)
+    registry = ProviderRegistry()
+    for name, fetch in [('slow', slow), ('fast', fast)]:
+        registry.register(PriceProvider(name, fetch, fetch.markets,
+                                        min_samples=args.min_samples,
+                                        probe_interval=args.probe_interval))
+
+    results = [check("registered order kept before there are statistics",
+                     prices_from(lookup(registry), slow) and
+                     order(registry) == ['slow', 'fast'])]
+    only_slow_prices = True
+    lookups = 1
+    while order(registry) != ['fast', 'slow'] and lookups < args.lookups:
+        only_slow_prices &= prices_from(lookup(registry), slow)
+        lookups += 1
+        time.sleep(args.probe_interval)
+    results.append(check("probed prices are never used",
+                         only_slow_prices))
+    results.append(check("faster provider first after %d lookups "
+                         "(at most %d)" % (lookups, args.lookups),
+                         order(registry) == ['fast', 'slow']))
+
+    start = time.time()
+    prices = lookup(registry)
+    results.append(check("lookups no longer wait for the slow provider",
+                         time.time() - start < args.latency and
+                         prices_from(prices, fast)))
+    for name, stats in sorted(registry.stats().items()):
+        print("  %-8s %3d calls, %.3fs average" % (
+              name, stats['calls'], stats['avg_latency']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the price provider registry with fake providers')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds each call to the slow provider takes')
+    parser.add_argument('--failures', type=int, default=3,
+                        help='failed calls in a row that open the circuit')
+    parser.add_argument('--reset', type=float, default=0.2,
+                        help='seconds before an open circuit is tried again')
+    parser.add_argument('--min-samples', type=int, default=5,
+                        help='calls needed before providers are reordered')
+    parser.add_argument('--probe-interval', type=float, default=0.01,
+                        help='seconds between probes of a provider')
+    parser.add_argument('--lookups', type=int, default=100,
+                        help='most lookups to wait for the reordering')
+    args = parser.parse_args()
+
+    results = check_breaker(args) + check_ordering(args)
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Sample pastes of the formats people throw at evepraisal, used by the
+# benchmarks in this directory. Bigger inputs are built by repeating these
+# with different quantities (see build_paste).
+
+CARGO_SCAN = u"""\
+10 Tritanium
+2,500 Pyerite
+1 Medium Shield Extender II
+3 Warp Disruptor II
+150 Antimatter Charge S"""
+
+EFT = u"""\
+[Rifter, Fleet Tackle]
+Nanofiber Internal Structure I
+Nanofiber Internal Structure I
+Overdrive Injector System I
+
+Stasis Webifier I
+Warp Disruptor I
+1MN Microwarpdrive I
+
+200mm AutoCannon I, EMP S
+200mm AutoCannon I, EMP S
+200mm AutoCannon I, EMP S
+[empty high slot]
+
+Small Anti-Kinetic Pump I
+Small Projectile Burst Aerator I"""
+
+KILLMAIL = u"""\
+2013.07.10 19:43
+
+Victim: Some Pilot
+Corp: Some Corp
+Alliance: None
+Faction: None
+Destroyed: Rifter
+System: Jita
+Security: 0.9
+Damage Taken: 1234
+
+Involved parties:
+
+Name: Another Pilot (laid the final blow)
+Security: 0.0
+Corp: Another Corp
+Alliance: None
+Faction: None
+Ship: Thrasher
+Weapon: 125mm Gatling AutoCannon I
+Damage Done: 1234
+
+Destroyed items:
+
+Warp Disruptor I
+200mm AutoCannon I, Qty: 2
+EMP S, Qty: 100 (Cargo)
+
+Dropped items:
+
+1MN Microwarpdrive I
+Nanofiber Internal Structure I, Qty: 2"""
+
+DSCAN = u"""\
+Rifter\tRifter\t-
+Some Pilot's Thrasher\tThrasher\t2,500 km
+Jita IV - Moon 4 - Caldari Navy Assembly Plant\tCaldari Navy Assembly Plant\t-
+Tritanium\tTritanium\t12 AU"""
+
+ASSETS = u"""\
+Tritanium\t1,000\tMineral\tMaterial\t\t\t10 m3
+Pyerite\t500\tMineral\tMaterial\t\t\t5 m3
+Medium Shield Extender II\t2\tShield Extender\tModule\tMedium\tMedium\t20 m3
+Rifter\t1\tFrigate\tShip\tSmall\t\t27,289 m3"""
+
+CONTRACT = u"""\
+Rifter\t1\tFrigate\tShip\tFitted
+Warp Disruptor II\t3\tWarp Scrambler\tModule\t
+Tritanium\t10,000\tMineral\tMaterial\t"""
+
+VIEW_CONTENTS = u"""\
+Warp Disruptor I\tWarp Scrambler\tMedium Slot\t1
+200mm AutoCannon I\tProjectile Weapon\tHigh Slot\t3
+EMP S\tProjectile Ammo\tCargo Hold\t400"""
+
+LISTING = u"""\
+Tritanium
+Pyerite x 20
+5 Medium Shield Extender II
+PLEX"""
+
+HEURISTIC = u"""\
+Tritanium    lots of it    100
+Pyerite, some more 25
+Warp Disruptor II from the loot pile"""
+
+CORPUS = [
+    ('cargo_scan', CARGO_SCAN),
+    ('eft', EFT),
+    ('killmail', KILLMAIL),
+    ('dscan', DSCAN),
+    ('assets', ASSETS),
+    ('contract', CONTRACT),
+    ('view_contents', VIEW_CONTENTS),
+    ('listing', LISTING),
+    ('heuristic', HEURISTIC),
+    ('mixed', u'\n'.join([CARGO_SCAN, EFT, LISTING, KILLMAIL])),
+]
+
+
+def build_paste(text, copies):
+    """ Repeats the item lines of text copies times, changing the leading
+        quantities so they aren't merged by the parsers. """
+    lines = []
+    for i in range(copies):
+        for line in text.splitlines():
+            if line and line[0].isdigit():
+                line = '%d%s' % (i + 1, line.lstrip('0123456789,'))
+            lines.append(line)
+    return u'\n'.join(lines)
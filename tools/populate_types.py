@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # This is a script intended to be ran only when there are updates to the item
-# database. The results are dumped into a file as JSON to be read by the app.
+# database. The results are dumped into a file as JSON and into a SQLite index
+# to be read by the app. To only rebuild the index from an existing JSON file:
+#
+#   python tools/populate_types.py --index-only
 
 from __future__ import print_function
 
+import argparse
 import bz2
 import collections
 import json
@@ -25,6 +29,26 @@ COMP_TYPES = [
 
 SQLITE_DUMP_URL = "https://www.fuzzwork.co.uk/dump/sqlite-latest.sqlite.bz2"
 
+TYPES_OUTPUT_FILE = 'data/types.json'
+INDEX_OUTPUT_FILE = 'data/types.db'
+
+# Must match INDEX_VERSION in evepraisal/typedb.py
+INDEX_VERSION = 2
+INDEX_SCHEMA = '''
+CREATE TABLE types (
+    typeID INTEGER PRIMARY KEY,
+    groupID INTEGER,
+    typeName TEXT NOT NULL,
+    volume REAL,
+    market INTEGER NOT NULL,
+    components TEXT
+);
+CREATE TABLE names (
+    nameKey TEXT PRIMARY KEY,
+    typeID INTEGER NOT NULL
+);
+'''
+
 
 def download_database(destination_path):
     decompressor = bz2.BZ2Decompressor()
@@ -105,7 +129,61 @@ FROM invtypes'''):
         yield d
 
 
+def name_keys(type_name):
+    """ Returns every key a type can be found under: the normalized name
+        (see normalize_type_name in evepraisal/typedb.py) and the plain
+        lowercased name. """
+    normalized = ' '.join(type_name.lower().split()).rstrip('*').rstrip()
+    return [normalized, type_name.lower()]
+
+
+def write_type_index(all_types, path):
+    """ Writes the SQLite index used by evepraisal.typedb. It's written to
+        a temporary file first and moved into place so running workers keep
+        reading the old file until they restart. """
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    conn = sqlite3.connect(temp_path)
+    conn.executescript(INDEX_SCHEMA)
+    conn.executemany(
+        'INSERT INTO types VALUES (?, ?, ?, ?, ?, ?)',
+        ((t['typeID'], t['groupID'], t['typeName'], t['volume'],
+          int(t['market']),
+          json.dumps(t['components']) if 'components' in t else None)
+         for t in all_types))
+
+    # Later types win when names collide, same as the old dict lookup
+    names = {}
+    for t in all_types:
+        for key in name_keys(t['typeName']):
+            names[key] = t['typeID']
+    conn.executemany('INSERT INTO names VALUES (?, ?)', names.items())
+
+    conn.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    os.rename(temp_path, path)
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description='Build the item type data used by evepraisal')
+    parser.add_argument('--index-only', action='store_true',
+                        help='only rebuild %s from %s' % (INDEX_OUTPUT_FILE,
+                                                          TYPES_OUTPUT_FILE))
+    args = parser.parse_args()
+
+    if args.index_only:
+        print("Reading types from %s" % TYPES_OUTPUT_FILE)
+        with open(TYPES_OUTPUT_FILE) as f:
+            all_types = json.load(f)
+        print("Output type index to %s" % INDEX_OUTPUT_FILE)
+        write_type_index(all_types, INDEX_OUTPUT_FILE)
+        return
+
     temp_dir = tempfile.mkdtemp()
     try:
         db_path = os.path.join(temp_dir, 'eve-db.sqlite')
@@ -121,10 +199,12 @@ def main():
         print("Build type information")
         all_types = list(build_all_types(c))
 
-        types_output_file = 'data/types.json'
-        print("Output types to %s" % types_output_file)
-        with open(types_output_file, 'w') as f:
+        print("Output types to %s" % TYPES_OUTPUT_FILE)
+        with open(TYPES_OUTPUT_FILE, 'w') as f:
             f.write(json.dumps(all_types, indent=2))
+
+        print("Output type index to %s" % INDEX_OUTPUT_FILE)
+        write_type_index(all_types, INDEX_OUTPUT_FILE)
     finally:
         shutil.rmtree(temp_dir)
 
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Shows how long `import evepraisal` takes and which modules it spends the
+# most time importing (excluding their own imports), then how long the first type lookup takes (that's when
+# the type data gets loaded). Ran by `make profile_import`.
+
+from __future__ import print_function
+
+import __builtin__
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_import = __builtin__.__import__
+_timings = {}
+_stack = []
+
+
+def timed_import(name, *args, **kwargs):
+    """ Records the time spent importing each module, not counting the time
+        spent on the modules it imports in turn """
+    if name in sys.modules:
+        return _import(name, *args, **kwargs)
+    label = name
+    if not label and len(args) > 2:
+        # from . import a, b
+        importer = (args[0] or {}).get('__name__', '')
+        label = '%s:%s' % (importer, ','.join(args[2] or []))
+    _stack.append(0)
+    start = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _timings[label] = _timings.get(label, 0) + elapsed - children
+
+
+def main():
+    __builtin__.__import__ = timed_import
+    start = time.time()
+    import evepraisal  # noqa
+    import_time = time.time() - start
+    __builtin__.__import__ = _import
+
+    print("import evepraisal: %.1fms" % (import_time * 1000))
+    for name, elapsed in sorted(_timings.items(), key=lambda t: -t[1])[:10]:
+        print("  %-40s %7.1fms" % (name, elapsed * 1000))
+
+    from evepraisal.models import get_type_by_id
+    start = time.time()
+    get_type_by_id(34)
+    print("first type lookup: %.1fms" % ((time.time() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
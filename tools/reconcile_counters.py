@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Recounts the appraisal counters (see models.Counters) from the Appraisals
+# table every --interval seconds. The counters are kept up to date as
+# appraisals are added; this fixes any drift and creates the counters for
+# kinds and markets that didn't have one yet.
+#
+#   python tools/reconcile_counters.py --interval 3600
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evepraisal import app, db  # noqa
+from evepraisal.models import reconcile_counters  # noqa
+
+
+def reconcile():
+    start = time.time()
+    changed = reconcile_counters()
+    for name, (old, new) in sorted(changed.items()):
+        print("%s was %s, should be %s" % (name, old, new))
+    print("Reconciled counters in %.2fs, %d changed" % (
+          time.time() - start, len(changed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recount the appraisal counters')
+    parser.add_argument('--interval', type=int, default=60 * 60,
+                        help='seconds between recounts')
+    parser.add_argument('--once', action='store_true',
+                        help='recount once and exit')
+    args = parser.parse_args()
+
+    with app.app_context():
+        while True:
+            try:
+                reconcile()
+            except Exception as e:
+                if args.once:
+                    raise
+                app.logger.exception(e)
+            finally:
+                db.session.remove()
+
+            if args.once:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
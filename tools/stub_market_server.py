@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# A local stand-in for the upstream market APIs (eve-central marketstat and
+# eve-marketdata item_prices2). Prices are derived from the typeID so results
+# are predictable. Used to test and benchmark the pricing code offline:
+#
+#   python tools/stub_market_server.py --port 8099 --connect-latency 0.05
+#
+# and then point EVE_CENTRAL_URL/EVE_MARKETDATA_URL at it in application.cfg.
+
+from __future__ import print_function
+
+import argparse
+import gzip
+import json
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from urlparse import urlsplit, parse_qs
+
+MARKETSTAT_PATH = '/api/marketstat'
+ITEM_PRICES_PATH = '/api/item_prices2.json'
+
+
+def stub_prices(type_id):
+    "Returns the (buy, sell) prices the stub reports for type_id"
+    return float(type_id), float(type_id) * 1.1
+
+
+def marketstat_xml(type_ids):
+    types = []
+    for type_id in type_ids:
+        buy, sell = stub_prices(type_id)
+        stats = []
+        for stat_type, price in [('buy', buy), ('sell', sell),
+                                 ('all', (buy + sell) / 2)]:
+            stats.append(
+                '<%(t)s><volume>1000</volume><avg>%(p)s</avg><max>%(p)s</max>'
+                '<min>%(p)s</min><stddev>0</stddev><median>%(p)s</median>'
+                '<percentile>%(p)s</percentile></%(t)s>'
+                % {'t': stat_type, 'p': price})
+        types.append('<type id="%s">%s</type>' % (type_id, ''.join(stats)))
+    return ('<?xml version="1.0" encoding="utf-8"?><evec_api version="2.0">'
+            '<marketstat>%s</marketstat></evec_api>' % ''.join(types))
+
+
+def item_prices_json(type_ids, solarsystem_ids):
+    rows = []
+    for solarsystem_id in solarsystem_ids:
+        for type_id in type_ids:
+            buy, sell = stub_prices(type_id)
+            for buysell, price in [('b', buy), ('s', sell)]:
+                rows.append({'row': {'typeID': str(type_id),
+                                     'solarsystemID': solarsystem_id,
+                                     'buysell': buysell,
+                                     'price': str(price)}})
+    return json.dumps({'emd': {'result': rows}})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response so headers and body go out in one write
+    wbufsize = -1
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == MARKETSTAT_PATH:
+            body = marketstat_xml(query.get('typeid', []))
+            content_type = 'text/xml'
+        elif url.path == ITEM_PRICES_PATH:
+            type_ids = ','.join(query.get('type_ids', [])).split(',')
+            solarsystem_ids = ','.join(
+                query.get('solarsystem_ids', ['-1'])).split(',')
+            body = item_prices_json([t for t in type_ids if t],
+                                    solarsystem_ids)
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as f:
+                f.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count('connections')
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubMarketServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0,
+                 connect_latency=0):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.stats = {'connections': 0, 'requests': 0}
+        self._lock = threading.Lock()
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    @property
+    def base_url(self):
+        return 'http://%s:%s' % self.server_address
+
+    def start(self):
+        "Serves requests from a background thread"
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve fake upstream market API responses')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to sleep before each response')
+    parser.add_argument('--connect-latency', type=float, default=0,
+                        help='seconds to sleep on each new connection')
+    args = parser.parse_args()
+
+    server = StubMarketServer((args.host, args.port), latency=args.latency,
+                              connect_latency=args.connect_latency)
+    print("EVE_CENTRAL_URL = '%s%s'" % (server.base_url, MARKETSTAT_PATH))
+    print("EVE_MARKETDATA_URL = '%s%s'" % (server.base_url, ITEM_PRICES_PATH))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Keeps the price cache warm for the most appraised types so that most
+# estimates never have to wait on the upstream market APIs. The hottest types
+# for each market are worked out from the Prices of recent appraisals and
+# their prices:<system>:<type> cache entries are refreshed every --interval
+# seconds, which should be well below the cache timeout.
+#
+#   python tools/warm_prices.py --top 500 --interval 1800
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import desc  # noqa
+
+from evepraisal import app, db  # noqa
+from evepraisal.estimate import refresh_market_prices  # noqa
+from evepraisal.models import Appraisals  # noqa
+
+
+def hottest_types(appraisal_limit, top):
+    """ Returns {solarsystem_id: [typeId, ...]} with up to top typeIds per
+        market, most appraised first. """
+    counts = collections.defaultdict(collections.Counter)
+    q = db.session.query(Appraisals.Market, Appraisals.Prices)
+    q = q.order_by(desc(Appraisals.Created)).limit(appraisal_limit)
+    for market, prices in q.yield_per(500):
+        if market is None or not prices:
+            continue
+        counts[str(market)].update(type_id for type_id, _ in prices)
+
+    valid_markets = app.config['VALID_SOLAR_SYSTEMS']
+    return dict((market, [type_id for type_id, _ in c.most_common(top)])
+                for market, c in counts.items()
+                if market in valid_markets)
+
+
+def warm(appraisal_limit, top):
+    for market, type_ids in hottest_types(appraisal_limit, top).items():
+        start = time.time()
+        prices = refresh_market_prices(type_ids,
+                                       options={'solarsystem_id': market})
+        print("Refreshed %d/%d types for %s in %.2fs" % (
+              len(prices), len(type_ids),
+              app.config['VALID_SOLAR_SYSTEMS'][market],
+              time.time() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Refresh cached prices for the most appraised types')
+    parser.add_argument('--appraisals', type=int, default=5000,
+                        help='number of recent appraisals to look at')
+    parser.add_argument('--top', type=int, default=500,
+                        help='number of types to keep warm per market')
+    parser.add_argument('--interval', type=int, default=30 * 60,
+                        help='seconds between refreshes')
+    parser.add_argument('--once', action='store_true',
+                        help='refresh once and exit')
+    args = parser.parse_args()
+
+    with app.app_context():
+        while True:
+            try:
+                warm(args.appraisals, args.top)
+            except Exception as e:
+                if args.once:
+                    raise
+                app.logger.exception(e)
+            finally:
+                db.session.remove()
+
+            if args.once:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()